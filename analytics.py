@@ -0,0 +1,258 @@
+from sqlalchemy import bindparam, text
+
+# Listings are rolled up per manufacturer, bodystyle and year, and for the
+# whole inventory ('all', a single group with key 0), as {dimension: SQL
+# expression for a listing's group key}. Listings without a year are counted
+# under year 0
+DIMENSIONS = {
+    'all': "0",
+    'manufacturer': "manufacturer_id",
+    'bodystyle': "bodystyle_id",
+    'year': "coalesce(CAST(strftime('%Y', year) AS INTEGER), 0)",
+}
+# The values the inventory page offers as filters, counted for its facets
+# (see facets.py). Listings without a value aren't counted
+FACET_DIMENSIONS = {
+    'manufacturer': "manufacturer_id",
+    'bodystyle': "bodystyle_id",
+    'seats': "model_seats",
+    'eco_rating': "eco_rating",
+    'safety_rating': "safety_rating",
+}
+# Prices are also counted in buckets this wide, so a median only has to read
+# the exact prices of the one or two buckets it falls in
+PRICE_BUCKET_WIDTH = 1000
+
+# The rollup tables, as (table, dimensions, key columns after dimension and
+# group_key with their expressions, counted columns with their aggregates,
+# which listings count). Every counted column is a plain count or sum, so
+# adding and removing listings is adding and subtracting their aggregates
+ROLLUPS = [
+    ('inventory_rollup', DIMENSIONS, [], [
+        ('listing_count', "count(*)"),
+        ('price_count', "count(car_price)"),
+        ('price_sum', "coalesce(sum(car_price), 0)"),
+        ('distance_count', "count(distance)"),
+        ('distance_sum', "coalesce(sum(distance), 0)"),
+    ], "true"),
+    ('price_bucket_rollup', DIMENSIONS, [
+        ('price_bucket', f"car_price / {PRICE_BUCKET_WIDTH}"),
+    ], [
+        ('listing_count', "count(*)"),
+    ], "car_price IS NOT NULL"),
+    ('price_rollup', DIMENSIONS, [
+        ('price_bucket', f"car_price / {PRICE_BUCKET_WIDTH}"),
+        ('car_price', "car_price"),
+    ], [
+        ('listing_count', "count(*)"),
+    ], "car_price IS NOT NULL"),
+    ('facet_rollup', FACET_DIMENSIONS, [], [
+        ('listing_count', "count(*)"),
+    ], "true"),
+]
+
+# Labels of the groups of the dimensions keyed by a dimension id
+GROUP_LABELS = {
+    'manufacturer': "SELECT manufacturer_id, manufacturer_name FROM car_manufacturer",
+    'bodystyle': "SELECT bodystyle_id, bodystyle_name FROM car_bodystyle",
+}
+
+# Listings whose rollups change with a write, read from listing_view
+CHANGED_LISTINGS = "FROM listing_view WHERE stock_id IN :stock_ids"
+# Every listing, read from the stock tables themselves
+ALL_LISTINGS = "FROM car_stock JOIN car_model ON car_model.model_id = car_stock.model_id WHERE true"
+
+
+def _columns(keys, values):
+    return ['dimension', 'group_key'] + [column for column, _ in keys] + [column for column, _ in values]
+
+
+# The rollup rows of a table for the listings in source (a FROM clause
+# ending in a WHERE condition), multiplied by :sign
+def _select_rollup(dimension, group_key, keys, values, condition, source):
+    columns = [f"'{dimension}'", group_key] + [expression for _, expression in keys]
+    groups = ', '.join(str(i) for i in range(2, len(keys) + 3))
+    aggregates = [f":sign * {aggregate}" for _, aggregate in values]
+    return (f"SELECT {', '.join(columns + aggregates)} {source} "
+            f"AND {group_key} IS NOT NULL AND {condition} GROUP BY {groups}")
+
+
+def _upsert(table, dimension, group_key, keys, values, condition):
+    columns = _columns(keys, values)
+    conflict = ', '.join(columns[:len(columns) - len(values)])
+    updates = ', '.join(f"{column} = {column} + excluded.{column}" for column, _ in values)
+    return text(
+        f"INSERT INTO {table} ({', '.join(columns)}) "
+        f"{_select_rollup(dimension, group_key, keys, values, condition, CHANGED_LISTINGS)} "
+        f"ON CONFLICT ({conflict}) DO UPDATE SET {updates}"
+    ).bindparams(bindparam('stock_ids', expanding=True))
+
+
+# Adds the listing_view rows of the given stock rows to the rollups (sign 1)
+# or takes them away (sign -1). Runs on the caller's session, so the
+# rollups change in the same transaction as the cars
+def _apply(session, stock_ids, sign):
+    stock_ids = list(stock_ids)
+    if not stock_ids:
+        return
+    params = {'stock_ids': stock_ids, 'sign': sign}
+    if sign < 0:
+        # New listings aren't in listing_view yet: nothing to take away
+        found = session.execute(
+            text("SELECT count(*) " + CHANGED_LISTINGS).bindparams(bindparam('stock_ids', expanding=True)),
+            params,
+        ).scalar()
+        if not found:
+            return
+    for table, dimensions, keys, values, condition in ROLLUPS:
+        for dimension, group_key in dimensions.items():
+            session.execute(_upsert(table, dimension, group_key, keys, values, condition), params)
+        if sign < 0:
+            session.execute(text(f"DELETE FROM {table} WHERE listing_count = 0"))
+
+
+# Called with the listing_view rows of stock rows about to be rewritten
+def remove_listings(session, stock_ids):
+    _apply(session, stock_ids, -1)
+
+
+# Called once their listing_view rows are written
+def add_listings(session, stock_ids):
+    _apply(session, stock_ids, 1)
+
+
+# The rollups worked out again from car_stock, as {table: {key: counts}}
+def recompute_rollups(session):
+    expected = {}
+    for table, dimensions, keys, values, condition in ROLLUPS:
+        rows = {}
+        for dimension, group_key in dimensions.items():
+            select = _select_rollup(dimension, group_key, keys, values, condition, ALL_LISTINGS)
+            for row in session.execute(text(select), {'sign': 1}):
+                rows[tuple(row[:-len(values)])] = tuple(row[-len(values):])
+        expected[table] = rows
+    return expected
+
+
+def stored_rollups(session):
+    stored = {}
+    for table, dimensions, keys, values, condition in ROLLUPS:
+        columns = _columns(keys, values)
+        stored[table] = {
+            tuple(row[:-len(values)]): tuple(row[-len(values):])
+            for row in session.execute(text(f"SELECT {', '.join(columns)} FROM {table}"))
+        }
+    return stored
+
+
+# Rollup rows that differ from car_stock, as [(table, key, stored counts,
+# counts from car_stock)], with None for a row missing on either side
+def check_rollups(session):
+    stored = stored_rollups(session)
+    differences = []
+    for table, expected_rows in recompute_rollups(session).items():
+        stored_rows = stored[table]
+        for key in sorted(set(stored_rows) | set(expected_rows), key=repr):
+            if stored_rows.get(key) != expected_rows.get(key):
+                differences.append((table, key, stored_rows.get(key), expected_rows.get(key)))
+    return differences
+
+
+# Rebuilds every rollup from car_stock, e.g. after dimension ids were
+# merged. Works on a session or a connection
+def rebuild_rollups(session):
+    for table, dimensions, keys, values, condition in ROLLUPS:
+        session.execute(text(f"DELETE FROM {table}"))
+        for dimension, group_key in dimensions.items():
+            select = _select_rollup(dimension, group_key, keys, values, condition, ALL_LISTINGS)
+            session.execute(text(f"INSERT INTO {table} ({', '.join(_columns(keys, values))}) {select}"), {'sign': 1})
+
+
+# Median price of every group of a dimension, in one query. Running sums
+# of the bucket counts (per group) locate the bucket of the middle price,
+# or the two buckets of the two middle prices; only the exact prices in
+# those buckets are read, and their running sums pick out the middle ones
+MEDIAN_PRICES = """
+WITH middle AS (
+    SELECT group_key, (price_count + 1) / 2 AS low, price_count / 2 + 1 AS high
+    FROM inventory_rollup
+    WHERE dimension = :dimension AND price_count > 0
+),
+buckets AS (
+    SELECT group_key, price_bucket, listing_count,
+           sum(listing_count) OVER (PARTITION BY group_key ORDER BY price_bucket) AS through
+    FROM price_bucket_rollup
+    WHERE dimension = :dimension
+),
+middle_buckets AS (
+    SELECT buckets.group_key, buckets.price_bucket, buckets.through - buckets.listing_count AS before,
+           middle.low, middle.high
+    FROM buckets
+    JOIN middle ON middle.group_key = buckets.group_key
+    WHERE buckets.through >= middle.low AND buckets.through - buckets.listing_count < middle.high
+),
+prices AS (
+    SELECT middle_buckets.group_key, price_rollup.car_price, middle_buckets.low, middle_buckets.high,
+           middle_buckets.before + sum(price_rollup.listing_count) OVER (
+               PARTITION BY middle_buckets.group_key, middle_buckets.price_bucket ORDER BY price_rollup.car_price
+           ) AS through
+    FROM middle_buckets
+    JOIN price_rollup ON price_rollup.dimension = :dimension
+        AND price_rollup.group_key = middle_buckets.group_key
+        AND price_rollup.price_bucket = middle_buckets.price_bucket
+)
+SELECT group_key,
+       (min(CASE WHEN through >= low THEN car_price END) + min(CASE WHEN through >= high THEN car_price END)) / 2.0
+FROM prices
+GROUP BY group_key
+"""
+
+
+def _median_prices(session, dimension):
+    return dict(session.execute(text(MEDIAN_PRICES), {'dimension': dimension}).all())
+
+
+def _label(dimension, group_key, labels):
+    if dimension == 'all':
+        return 'All stock'
+    if dimension == 'year':
+        return str(group_key) if group_key else 'Unknown'
+    return labels.get(group_key, str(group_key))
+
+
+# Stock count, average and median price and average distance of each group
+# of a dimension, read from the rollups alone. Makes and bodystyles come
+# most stocked first, years newest first
+def dimension_summary(session, dimension):
+    totals = session.execute(
+        text("SELECT group_key, listing_count, price_count, price_sum, distance_count, distance_sum "
+             "FROM inventory_rollup WHERE dimension = :dimension"),
+        {'dimension': dimension},
+    ).all()
+    medians = _median_prices(session, dimension)
+    labels = dict(session.execute(text(GROUP_LABELS[dimension])).all()) if dimension in GROUP_LABELS else {}
+
+    groups = [{
+        'key': row.group_key,
+        'label': _label(dimension, row.group_key, labels),
+        'count': row.listing_count,
+        'average_price': row.price_sum / row.price_count if row.price_count else None,
+        'median_price': medians.get(row.group_key),
+        'average_distance': row.distance_sum / row.distance_count if row.distance_count else None,
+    } for row in totals]
+    if dimension == 'year':
+        groups.sort(key=lambda group: -group['key'])
+    else:
+        groups.sort(key=lambda group: (-group['count'], group['label']))
+    return groups
+
+
+# Everything the analytics page shows: the whole inventory, then each
+# dimension
+def inventory_summary(session):
+    overall = dimension_summary(session, 'all')
+    summary = {'inventory': overall[0] if overall else None}
+    for dimension in DIMENSIONS:
+        if dimension != 'all':
+            summary[dimension] = dimension_summary(session, dimension)
+    return summary
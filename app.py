@@ -1,48 +1,104 @@
+import logging
 import os
+import time
 from flask import Flask
 from models import db
 from routes import register_routes
-from flask_sqlalchemy import SQLAlchemy
 from flask_bootstrap import Bootstrap
+from flask_migrate import Migrate, stamp, upgrade
+from sqlalchemy import inspect
+from assets import register_assets
+from commands import register_commands
+from config import config_for
+from metrics import register_metrics, request_metrics
+from database import configure_database, dispose_engines
+import facets
+import inventory
+import similar
+import suggest
 
-# Initialize SQLAlchemy
-db = SQLAlchemy()
+logger = logging.getLogger(__name__)
+
+# Initialise Flask-Migrate, the migrations live in the migrations folder
+migrate = Migrate(render_as_batch=True)
+# Revision matching databases created with db.create_all() before migrations
+BASELINE_REVISION = '7f8db91eb4cd'
 # Initalise bootstrap
 bootstrap = Bootstrap()
-# Configuring the flask routes 
-app = Flask(__name__, static_url_path='/static', static_folder='static')
-def create_app():
-    # Create the app at module level
-    app = Flask(__name__, instance_relative_config=True)
-    Bootstrap(app)
-
-    # Check if instance folder exists
-    try:
-        os.makedirs(app.instance_path)
-    except OSError:
-        pass
-
-    # Database path (in the instance folder)
-    DB_FILENAME = 'database.db'
-    DB_PATH = os.path.join(app.instance_path, DB_FILENAME)
-    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{DB_PATH}'
-    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+
+# Runs any migrations the database hasn't had yet. New databases are built
+# entirely by the migrations; databases made by db.create_all() before there
+# were migrations are first marked as being at the baseline revision
+def upgrade_database():
+    tables = inspect(db.engine).get_table_names()
+    if 'car_stock' in tables and 'alembic_version' not in tables:
+        stamp(revision=BASELINE_REVISION)
+    upgrade()
+
+# Builds the app for a config profile (see config.py). Nothing here runs at
+# import time, so importing the app (or its CLI) stays cheap
+def create_app(config=None):
+    started = time.perf_counter()
+    app = Flask(__name__, instance_relative_config=True, static_url_path='/static', static_folder='static')
+    app.config.from_object(config_for(config))
+    # Any setting can be overridden from a FLASK_ environment variable
+    app.config.from_prefixed_env()
+
+    # The default database lives in the instance folder
+    if not app.config['SQLALCHEMY_DATABASE_URI']:
+        os.makedirs(app.instance_path, exist_ok=True)
+        app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(app.instance_path, 'database.db')}"
 
     # Initialize plugins
+    bootstrap.init_app(app)
     db.init_app(app)
+    # SQLite pragmas and the read-only engine for GET requests
+    configure_database(app, db)
+    migrate.init_app(app, db, directory=os.path.join(app.root_path, 'migrations'))
 
-    # CREATE DB ONLY IF IT DOES NOT EXIST
-    with app.app_context():
-        if not os.path.exists(DB_PATH):
-            db.create_all()
+    # Create or upgrade the database
+    if app.config['AUTO_MIGRATE']:
+        with app.app_context():
+            upgrade_database()
+
+    # Time requests, SQL and templates for /metrics
+    register_metrics(app, db)
+
+    # asset_url() for the templates
+    register_assets(app)
 
     # Register routes file
-    from routes import register_routes
     register_routes(app, db)
 
+    # Register command line tools
+    register_commands(app, db)
+
+    request_metrics.startup('create_app', time.perf_counter() - started)
+    if app.config['WARM_UP']:
+        warm_up(app)
     return app
 
+# Compiles every template, runs the queries behind the first inventory
+# page and builds the similar-cars and suggestion indexes, so the first
+# requests don't pay for them. Under gunicorn this runs once in the master
+# and the workers inherit the result. The connections used are closed again, so no worker
+# starts with one it shares
+def warm_up(app):
+    started = time.perf_counter()
+    for name in app.jinja_env.list_templates(extensions=['html']):
+        app.jinja_env.get_template(name)
+    with app.app_context():
+        query = inventory.listing_query(db.session)
+        inventory.paginate(query, inventory.DEFAULT_SORT, False, inventory.DEFAULT_PAGE_SIZE)
+        facets.facet_counts(db.session, None, {})
+        # The workers share the feature matrix pages until they write to it
+        similar.get_index(db.session)
+        suggest.get_index(db.session)
+        db.session.remove()
+    dispose_engines()
+    seconds = time.perf_counter() - started
+    request_metrics.startup('warm_up', seconds)
+    logger.info("Warmed up in %.0f ms", seconds * 1000)
+
 if __name__ == '__main__':
-    # Create the app again?
-    app = create_app()
-    app.run()
\ No newline at end of file
+    create_app().run()
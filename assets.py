@@ -0,0 +1,247 @@
+from flask import current_app, url_for
+from io import BytesIO
+from urllib.request import urlopen
+from werkzeug.security import safe_join
+import gzip
+import hashlib
+import json
+import logging
+import os
+import posixpath
+import threading
+
+# Pillow resizes the mirrored images. Without it they are left on the
+# remote server
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# Brotli is optional: without it only gzip copies are built
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Built assets go in this folder under static, with the manifest that maps
+# each source name (e.g. css/contents.css) to its fingerprinted copy
+DIST_FOLDER = 'dist'
+MANIFEST_NAME = 'manifest.json'
+# URL the built assets are served from, see serve_asset in routes.py
+ASSET_URL_PATH = '/assets'
+# Characters of the content hash put in a built file's name
+HASH_LENGTH = 12
+# Files worth compressing, by extension. Images are compressed already
+COMPRESSIBLE = {'.css', '.js', '.svg', '.json', '.txt', '.html'}
+# Encodings a compressed copy is built for, best first, as
+# (Content-Encoding, file suffix)
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+# Remote images the pages show, mirrored by the build so pages don't wait on
+# another server, as {local name: (url, widest size kept)}. Until they are
+# built, asset_url sends the remote URL
+REMOTE_IMAGES = {
+    'images/background.jpg': (
+        'https://static.vecteezy.com/system/resources/previews/008/423/535/non_2x/3d-black-geometric-abstract-background-overlap-layer-on-dark-space-with-line-motion-style-effect-graphic-design-element-carbon-fiber-texture-concept-for-banner-flyer-card-brochure-cover-etc-vector.jpg',
+        1920,
+    ),
+    'images/header.jpg': (
+        'https://encrypted-tbn0.gstatic.com/images?q=tbn:ANd9GcRcPij9DbVxKJ0V-vitlvOEMDtf_F5qAX_7fA&s',
+        1200,
+    ),
+    'images/hero-qashqai.jpg': (
+        'https://www-asia.nissan-cdn.net/content/dam/Nissan/AU/Images/homepage/redesign/compressed/award-NIS4334_Qashqai_2022_homepage_d-with-GDA-2-2000x821.jpg.ximg.full.hero.jpg',
+        1600,
+    ),
+    'images/hero-navara.jpg': (
+        'https://www-asia.nissan-cdn.net/content/dam/Nissan/AU/Images/homepage/new-navara-pro-4x-homepage-banner-3840x1574.jpg.ximg.full.hero.jpg',
+        1600,
+    ),
+    'images/hero-x-trail.jpg': (
+        'https://www-asia.nissan-cdn.net/content/dam/Nissan/new-zealand/images/homepage/NIS5140-13_Nissan-X-TRAIL-Production_Digital_HeroDesktop_1620x1152-v.jpg.ximg.full.hero.jpg',
+        1600,
+    ),
+}
+MIRRORED_IMAGE_QUALITY = 80
+DOWNLOAD_TIMEOUT = 30
+
+
+def _fingerprinted(name, content):
+    digest = hashlib.sha256(content).hexdigest()[:HASH_LENGTH]
+    stem, extension = posixpath.splitext(name)
+    return f'{stem}.{digest}{extension}'
+
+
+def _write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+def _compressed(content):
+    copies = {'.gz': gzip.compress(content, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        copies['.br'] = brotli.compress(content, quality=11)
+    # A copy no smaller than the original isn't worth sending
+    return {suffix: data for suffix, data in copies.items() if len(data) < len(content)}
+
+
+# Downloads a remote image and scales it down to max_width, as JPEG bytes
+def _mirror_image(url, max_width):
+    with urlopen(url, timeout=DOWNLOAD_TIMEOUT) as response:
+        data = response.read()
+    with Image.open(BytesIO(data)) as image:
+        image = image.convert('RGB')
+        if image.width > max_width:
+            image = image.resize((max_width, round(image.height * max_width / image.width)), Image.LANCZOS)
+        out = BytesIO()
+        image.save(out, 'JPEG', quality=MIRRORED_IMAGE_QUALITY, optimize=True, progressive=True)
+    return out.getvalue()
+
+
+def _read_manifest(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+# Builds static/dist: a fingerprinted copy of every file under static, plus
+# gzip and brotli copies of the text ones, and resized copies of
+# REMOTE_IMAGES (mirror=False keeps the ones from the last build instead of
+# downloading them again). Stylesheets are rewritten to point at the
+# mirrored images. Files from builds before the previous one are removed.
+# Returns the new manifest
+def build_assets(static_folder, mirror=True):
+    dist = os.path.join(static_folder, DIST_FOLDER)
+    manifest_path = os.path.join(dist, MANIFEST_NAME)
+    previous = _read_manifest(manifest_path)
+    manifest = {}
+
+    for name, (url, max_width) in REMOTE_IMAGES.items():
+        content = None
+        if mirror and Image is not None:
+            try:
+                content = _mirror_image(url, max_width)
+            except (OSError, ValueError) as e:
+                logger.warning("Couldn't mirror %s: %s", url, e)
+        if content is None:
+            # Keep the copy from the last build, if there is one
+            if name in previous and os.path.exists(os.path.join(dist, previous[name])):
+                manifest[name] = previous[name]
+            continue
+        manifest[name] = _fingerprinted(name, content)
+        _write(os.path.join(dist, manifest[name]), content)
+
+    for root, folders, files in os.walk(static_folder):
+        if root == static_folder and DIST_FOLDER in folders:
+            folders.remove(DIST_FOLDER)
+        for filename in sorted(files):
+            path = os.path.join(root, filename)
+            name = os.path.relpath(path, static_folder).replace(os.sep, '/')
+            with open(path, 'rb') as f:
+                content = f.read()
+            if name.endswith('.css'):
+                content = _link_mirrored_images(name, content, manifest)
+            manifest[name] = _fingerprinted(name, content)
+            built = os.path.join(dist, manifest[name])
+            _write(built, content)
+            if posixpath.splitext(name)[1] in COMPRESSIBLE:
+                for suffix, data in _compressed(content).items():
+                    _write(built + suffix, data)
+
+    _write(manifest_path, json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8'))
+    _remove_old_builds(dist, set(manifest.values()) | set(previous.values()))
+    return manifest
+
+
+# Points the remote image URLs in a stylesheet at their mirrored copies
+def _link_mirrored_images(name, content, manifest):
+    text = content.decode('utf-8')
+    for image_name, (url, max_width) in REMOTE_IMAGES.items():
+        if image_name in manifest and url in text:
+            text = text.replace(url, posixpath.relpath(manifest[image_name], posixpath.dirname(name)))
+    return text.encode('utf-8')
+
+
+# Pages served before a deploy still link the previous build, so that one
+# is kept; anything older goes
+def _remove_old_builds(dist, keep):
+    keep = {name.replace('/', os.sep) for name in keep}
+    for root, folders, files in os.walk(dist):
+        for filename in files:
+            path = os.path.join(root, filename)
+            name = os.path.relpath(path, dist)
+            for suffix in ('.gz', '.br'):
+                if name.endswith(suffix):
+                    name = name[:-len(suffix)]
+            if name != MANIFEST_NAME and name not in keep:
+                os.remove(path)
+
+
+# The manifest of each static folder, re-read when a build replaces it
+class Manifest:
+    def __init__(self, path):
+        self.path = path
+        self._seen = None
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            if key != self._seen:
+                self._entries = _read_manifest(self.path)
+                self._seen = key
+            return self._entries.get(name)
+
+
+_manifests = {}
+
+
+def _manifest():
+    path = os.path.join(current_app.static_folder, DIST_FOLDER, MANIFEST_NAME)
+    manifest = _manifests.get(path)
+    if manifest is None:
+        manifest = _manifests.setdefault(path, Manifest(path))
+    return manifest
+
+
+# URL of a static file (e.g. 'css/contents.css') or mirrored image (e.g.
+# 'images/hero-navara.jpg'). Built assets get their fingerprinted URL,
+# which can be cached forever; before a build, the plain static file or the
+# remote image
+def asset_url(name):
+    built = _manifest().get(name)
+    if built is not None:
+        return f'{ASSET_URL_PATH}/{built}'
+    if name in REMOTE_IMAGES:
+        return REMOTE_IMAGES[name][0]
+    return url_for('static', filename=name)
+
+
+# The file to send for a built asset, as (path, Content-Encoding or None),
+# choosing the smallest encoding the client accepts. Files from the
+# previous build are still served, for pages rendered before it was
+# replaced. None for anything else
+def asset_file(filename, accept_encodings):
+    path = safe_join(os.path.join(current_app.static_folder, DIST_FOLDER), filename)
+    if path is None or filename == MANIFEST_NAME or not os.path.isfile(path):
+        return None
+    for encoding, suffix in ENCODINGS:
+        if accept_encodings[encoding] and os.path.exists(path + suffix):
+            return path + suffix, encoding
+    return path, None
+
+
+def register_assets(app):
+    app.add_template_global(asset_url)
@@ -0,0 +1,214 @@
+# Builds a synthetic inventory database for the benchmarks:
+#
+#     python -m bench.generate --rows 100000
+#
+# Makes and models follow a long-tailed distribution (a few makes and models
+# account for most of the stock, like a real yard), prices depend on the
+# model, age and distance, and every listing has a full-sized photo from a
+# pool of generated JPEGs in the image store
+from datetime import date
+from io import BytesIO
+import argparse
+import os
+import random
+import sys
+import time
+
+try:
+    from PIL import Image, ImageDraw, ImageFilter
+except ImportError:
+    Image = None
+
+# (manufacturer, [(model, bodystyle, base price, horsepower, seats)]),
+# most common first
+CATALOGUE = [
+    ('Toyota', [('Corolla', 'Hatchback', 28000, 126, 5), ('RAV4', 'SUV', 42000, 203, 5),
+                ('Camry', 'Sedan', 36000, 203, 5), ('HiLux', 'Ute', 52000, 201, 5),
+                ('Yaris', 'Hatchback', 24000, 91, 5), ('LandCruiser', 'SUV', 95000, 304, 7)]),
+    ('Mazda', [('CX-5', 'SUV', 38000, 187, 5), ('Mazda3', 'Hatchback', 30000, 153, 5),
+               ('CX-3', 'SUV', 29000, 147, 5), ('BT-50', 'Ute', 48000, 188, 5)]),
+    ('Ford', [('Ranger', 'Ute', 55000, 207, 5), ('Everest', 'SUV', 62000, 207, 7),
+              ('Mustang', 'Coupe', 68000, 450, 4), ('Focus', 'Hatchback', 27000, 125, 5)]),
+    ('Hyundai', [('i30', 'Hatchback', 27000, 159, 5), ('Tucson', 'SUV', 37000, 178, 5),
+                 ('Kona', 'SUV', 31000, 147, 5), ('Santa Fe', 'SUV', 50000, 197, 7)]),
+    ('Mitsubishi', [('Triton', 'Ute', 45000, 181, 5), ('Outlander', 'SUV', 40000, 181, 7),
+                    ('ASX', 'SUV', 28000, 147, 5)]),
+    ('Kia', [('Sportage', 'SUV', 38000, 178, 5), ('Cerato', 'Sedan', 26000, 147, 5),
+             ('Carnival', 'People Mover', 52000, 290, 8), ('Picanto', 'Hatchback', 17000, 83, 5)]),
+    ('Nissan', [('Navara', 'Ute', 50000, 188, 5), ('X-Trail', 'SUV', 40000, 179, 7),
+                ('Qashqai', 'SUV', 36000, 156, 5), ('Patrol', 'SUV', 88000, 400, 8)]),
+    ('Volkswagen', [('Golf', 'Hatchback', 36000, 147, 5), ('Tiguan', 'SUV', 45000, 162, 5),
+                    ('Amarok', 'Ute', 60000, 241, 5)]),
+    ('Subaru', [('Forester', 'SUV', 40000, 182, 5), ('Outback', 'Wagon', 46000, 182, 5),
+                ('WRX', 'Sedan', 52000, 268, 5)]),
+    ('Honda', [('Civic', 'Hatchback', 36000, 158, 5), ('CR-V', 'SUV', 42000, 190, 7),
+               ('HR-V', 'SUV', 34000, 130, 5), ('Jazz', 'Hatchback', 22000, 118, 5)]),
+    ('Tesla', [('Model 3', 'Sedan', 62000, 283, 5), ('Model Y', 'SUV', 68000, 299, 5)]),
+    ('BMW', [('X3', 'SUV', 80000, 248, 5), ('3 Series', 'Sedan', 75000, 255, 5),
+             ('1 Series', 'Hatchback', 50000, 178, 5)]),
+    ('Mercedes-Benz', [('C-Class', 'Sedan', 80000, 255, 5), ('GLC', 'SUV', 90000, 255, 5),
+                       ('A-Class', 'Hatchback', 55000, 161, 5), ('Sprinter', 'Van', 85000, 188, 3)]),
+    ('Isuzu', [('D-Max', 'Ute', 50000, 188, 5), ('MU-X', 'SUV', 55000, 188, 7)]),
+    ('Suzuki', [('Swift', 'Hatchback', 22000, 89, 5), ('Jimny', 'SUV', 33000, 101, 4),
+                ('Vitara', 'SUV', 32000, 138, 5)]),
+    ('Audi', [('A3', 'Hatchback', 52000, 148, 5), ('Q5', 'SUV', 82000, 261, 5)]),
+    ('MG', [('ZS', 'SUV', 25000, 112, 5), ('MG3', 'Hatchback', 19000, 104, 5)]),
+    ('Lexus', [('RX', 'SUV', 95000, 275, 5), ('IS', 'Sedan', 70000, 241, 5)]),
+    ('Volvo', [('XC60', 'SUV', 75000, 247, 5), ('XC40', 'SUV', 58000, 194, 5)]),
+    ('Jeep', [('Wrangler', 'SUV', 70000, 285, 5), ('Grand Cherokee', 'SUV', 80000, 293, 5)]),
+    ('Land Rover', [('Defender', 'SUV', 110000, 296, 5), ('Discovery', 'SUV', 100000, 296, 7)]),
+    ('Porsche', [('911', 'Coupe', 250000, 379, 4), ('Cayenne', 'SUV', 150000, 348, 5)]),
+    ('Skoda', [('Octavia', 'Wagon', 40000, 148, 5), ('Kodiaq', 'SUV', 55000, 187, 7)]),
+    ('Renault', [('Koleos', 'SUV', 42000, 168, 5), ('Megane', 'Hatchback', 32000, 138, 5)]),
+    ('Peugeot', [('3008', 'SUV', 50000, 178, 5), ('208', 'Hatchback', 32000, 128, 5)]),
+    ('Fiat', [('500', 'Hatchback', 25000, 68, 4)]),
+    ('Alfa Romeo', [('Giulia', 'Sedan', 70000, 276, 5)]),
+    ('Ferrari', [('Roma', 'Coupe', 420000, 612, 4)]),
+]
+
+# Exponent of the Zipf-like weights; higher means more skewed
+SKEW = 1.1
+IMAGE_POOL_SIZE = 200
+# Photos in the pool are roughly the size a phone upload is scaled to
+IMAGE_SIZE = (1600, 1067)
+
+
+def _weights(count):
+    return [1 / (rank ** SKEW) for rank in range(1, count + 1)]
+
+
+# Yields rows in the format bulk_import.parse_row reads, deterministic for
+# a given seed
+def synthetic_rows(count, seed=0, this_year=2025):
+    rng = random.Random(seed)
+    makes = [make for make, models in CATALOGUE]
+    make_weights = _weights(len(makes))
+    models = {make: (entries, _weights(len(entries))) for make, entries in CATALOGUE}
+
+    for i in range(count):
+        make = rng.choices(makes, make_weights)[0]
+        entries, weights = models[make]
+        model, bodystyle, base_price, horsepower, seats = rng.choices(entries, weights)[0]
+        age = min(int(rng.expovariate(1 / 5)), 30)
+        distance = max(0, int(rng.gauss(15000 * age, 6000 + 4000 * age)))
+        # Cars lose about 12% a year and a bit more with distance
+        price = base_price * (0.88 ** age) * max(0.3, 1 - distance / 600000) * rng.uniform(0.9, 1.1)
+        yield {
+            'manufacturer': make,
+            'bodystyle': bodystyle,
+            'model': model,
+            'horsepower': horsepower,
+            'torque': int(horsepower * rng.uniform(1.2, 1.8)),
+            'eco_rating': rng.choices(range(1, 6), [1, 2, 4, 3, 2])[0],
+            'safety_rating': rng.choices(range(1, 6), [1, 1, 2, 5, 8])[0],
+            'seats': seats,
+            'year': date(this_year - age, 1, 1).isoformat(),
+            'price': max(1000, int(price / 10) * 10),
+            'distance': distance,
+        }
+
+
+# A JPEG photo-sized image: soft shapes over a gradient with sensor-like
+# noise, which compresses to a couple of hundred kB like a real photo.
+# Without Pillow, random bytes behind a JPEG header of a similar size
+def synthetic_image(rng, noise=None):
+    if Image is None:
+        return b'\xff\xd8\xff\xe0' + rng.randbytes(rng.randint(150000, 450000))
+    # The shapes are drawn and blurred at a quarter of the size, which looks
+    # the same once scaled up and is much quicker
+    width, height = IMAGE_SIZE[0] // 4, IMAGE_SIZE[1] // 4
+    image = Image.linear_gradient('L').resize((width, height)).convert('RGB')
+    draw = ImageDraw.Draw(image)
+    for _ in range(12):
+        x, y = rng.randrange(width), rng.randrange(height)
+        r = rng.randint(15, 100)
+        draw.ellipse((x - r, y - r, x + r, y + r), fill=tuple(rng.randrange(256) for _ in range(3)))
+    image = image.filter(ImageFilter.GaussianBlur(2)).resize(IMAGE_SIZE, Image.BICUBIC)
+    if noise is None:
+        noise = Image.effect_noise(IMAGE_SIZE, 24).convert('RGB')
+    image = Image.blend(image, noise, 0.15)
+    out = BytesIO()
+    image.save(out, 'JPEG', quality=85)
+    return out.getvalue()
+
+
+def _progress(stats):
+    print(f"  {stats['imported']:>9} rows  {stats['rows_per_sec']:>9.0f} rows/s", file=sys.stderr)
+
+
+# Creates (or replaces) a database of count listings in out_dir, plus its
+# image store, and returns the path of the database
+def generate(out_dir, count, seed=0, image_pool=IMAGE_POOL_SIZE):
+    out_dir = os.path.abspath(out_dir)
+    os.makedirs(out_dir, exist_ok=True)
+    db_path = os.path.join(out_dir, 'database.db')
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+    os.environ.update(bench_env(out_dir))
+
+    from app import create_app
+    from bulk_import import import_rows
+    from image_store import get_image_store
+    from models import db
+    from sqlalchemy import text
+    from variants import build_variants
+
+    app = create_app()
+    with app.app_context():
+        started = time.perf_counter()
+        stats = import_rows(db.session, synthetic_rows(count, seed), progress=_progress)
+        print(f"Imported {stats['imported']} rows in {stats['seconds']:.1f}s", file=sys.stderr)
+
+        # Photos: a pool of distinct images in the store, shared by the
+        # listings round robin, one car_images row per listing
+        rng = random.Random(seed)
+        image_store = get_image_store()
+        noise = Image.effect_noise(IMAGE_SIZE, 24).convert('RGB') if Image is not None else None
+        hashes = []
+        for _ in range(image_pool):
+            digest = image_store.put(synthetic_image(rng, noise))
+            build_variants(image_store, digest)
+            hashes.append(digest)
+        connection = db.session.connection()
+        connection.execute(text("CREATE TEMP TABLE image_pool (slot INTEGER PRIMARY KEY, image_hash TEXT)"))
+        connection.execute(text("INSERT INTO image_pool VALUES (:slot, :image_hash)"),
+                           [{'slot': slot, 'image_hash': digest} for slot, digest in enumerate(hashes)])
+        connection.execute(text(
+            "INSERT INTO car_images (image_id, image_car, image_hash, image_mimetype) "
+            "SELECT stock_id, 'bench_' || stock_id, image_hash, 'image/jpeg' "
+            "FROM car_stock JOIN image_pool ON slot = stock_id % :pool"
+        ), {'pool': len(hashes)})
+        connection.execute(text("UPDATE car_stock SET image_id = stock_id"))
+        connection.execute(text("UPDATE listing_view SET image_id = stock_id"))
+        connection.execute(text("DROP TABLE image_pool"))
+        db.session.commit()
+        db.session.execute(text("ANALYZE"))
+        db.session.commit()
+        print(f"Built {count} listings in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+        db.engine.dispose()
+    return db_path
+
+
+# Environment that points the app at a benchmark data directory
+def bench_env(data_dir):
+    data_dir = os.path.abspath(data_dir)
+    return {
+        'FLASK_SQLALCHEMY_DATABASE_URI': f"sqlite:///{os.path.join(data_dir, 'database.db')}",
+        'FLASK_IMAGE_STORE_PATH': os.path.join(data_dir, 'images'),
+        'FLASK_INVENTORY_VERSION_PATH': os.path.join(data_dir, 'inventory.version'),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a synthetic inventory database for the benchmarks")
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--out', help="data directory (default bench_data/<rows>)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--image-pool', type=int, default=IMAGE_POOL_SIZE)
+    args = parser.parse_args()
+    generate(args.out or os.path.join('bench_data', str(args.rows)), args.rows, args.seed, args.image_pool)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,405 @@
+# Load benchmark for the main pages, run against generated databases:
+#
+#     python -m bench.run --rows 10000 100000 --server client gunicorn
+#
+# Each scenario is timed through the Flask test client (the app's own cost,
+# no HTTP) and/or a local gunicorn (the full stack, with concurrent clients;
+# "flask run" stands in where gunicorn isn't installed). Reports p50/p95/p99
+# latency, throughput, peak RSS and startup time, and exits non-zero when a
+# result is worse than bench/baselines.json by more than the tolerance, when
+# a page is slower than the p95 budget or when any request fails
+from bench.generate import bench_env, generate, synthetic_image
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+import argparse
+import http.client
+import importlib.util
+import json
+import os
+import random
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+BASELINES_PATH = os.path.join(os.path.dirname(__file__), 'baselines.json')
+# How much worse than the baseline a result may be before the run fails
+DEFAULT_TOLERANCE = 0.25
+# The slowest a scenario's p95 may be at any database size, whatever the
+# baselines say, so a slow page can't be stored as the new normal
+P95_BUDGET_MS = 1000
+# A request still running after this long has failed: gunicorn restarts the
+# worker and the client stops waiting
+REQUEST_TIMEOUT = 30
+SCENARIOS = ['home', 'contents', 'contents_search', 'image', 'image_thumb', 'add_listing']
+SEARCH_TERMS = ['toyota', 'cx', 'ranger', 'suv', 'ute', 'model', 'golf', 'hatch', 'sub', 'mercedes']
+SORTS = ['price', 'year', 'distance']
+
+
+# The requests a scenario makes, as (method, path, form fields, files).
+# Drawn at random, but the same for a given seed and database size
+def scenario_requests(name, count, rows, seed=0):
+    rng = random.Random(f'{name}-{seed}')
+    image = synthetic_image(rng) if name == 'add_listing' else None
+    for _ in range(count):
+        if name == 'home':
+            yield 'GET', '/', None, None
+        elif name == 'contents':
+            args = {'sort': rng.choice(SORTS), 'order': rng.choice(['asc', 'desc'])}
+            # A third of the views narrow the list with a filter
+            if rng.random() < 0.33:
+                args[rng.choice(['manufacturer', 'bodystyle'])] = rng.randint(1, 5)
+            yield 'GET', '/contents?' + urlencode(args), None, None
+        elif name == 'contents_search':
+            yield 'GET', '/contents?' + urlencode({'query': rng.choice(SEARCH_TERMS)}), None, None
+        elif name == 'image':
+            yield 'GET', f'/images/{rng.randint(1, rows)}', None, None
+        elif name == 'image_thumb':
+            yield 'GET', f'/images/{rng.randint(1, rows)}?size=thumb', None, None
+        elif name == 'add_listing':
+            form = {
+                'manufacturer': 'Toyota', 'bodystyle': 'SUV', 'car_name': 'RAV4',
+                'horsepower': '203', 'torque': '221', 'eco_rating': '4', 'safety_rating': '5',
+                'seats': '5', 'year': str(rng.randint(2010, 2025)), 'price': str(rng.randint(15000, 45000)),
+                'distance': str(rng.randint(0, 200000)),
+            }
+            yield 'POST', '/add-listing', form, {'image': ('car.jpg', image)}
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarise(latencies, seconds, errors):
+    latencies = sorted(latencies)
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'rps': round(len(latencies) / seconds, 1) if seconds else 0.0,
+    }
+
+
+# Peak resident memory of this process, in MB
+def own_peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kB, macOS bytes
+    return round(peak / 1024 / (1024 if sys.platform == 'darwin' else 1), 1)
+
+
+# Peak resident memory of a process and its children (the gunicorn workers),
+# in MB, read from /proc. None where there is no /proc
+def tree_peak_rss_mb(pid):
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children') as f:
+            children = [int(child) for child in f.read().split()]
+    except OSError:
+        return None
+    peak = 0
+    for process in [pid] + children:
+        try:
+            with open(f'/proc/{process}/status') as f:
+                for line in f:
+                    if line.startswith('VmHWM:'):
+                        peak = max(peak, int(line.split()[1]))
+        except OSError:
+            pass
+    return round(peak / 1024, 1)
+
+
+# A scratch copy of the generated database, so the writes one run makes
+# don't carry over to the next
+def scratch_copy(data_dir):
+    run_dir = os.path.join(data_dir, 'run')
+    if os.path.exists(run_dir):
+        shutil.rmtree(run_dir)
+    os.makedirs(run_dir)
+    shutil.copy(os.path.join(data_dir, 'database.db'), os.path.join(run_dir, 'database.db'))
+    return run_dir
+
+
+# Settings for an app on the scratch database. The image store is only
+# added to, so the generated one is shared
+def run_env(data_dir, run_dir, page_cache):
+    env = bench_env(run_dir)
+    env['FLASK_IMAGE_STORE_PATH'] = os.path.join(data_dir, 'images')
+    env['FLASK_PAGE_CACHE'] = json.dumps(page_cache)
+    return env
+
+
+# Cold start: a fresh interpreter importing the app and running the
+# factory, best of a few tries, in seconds
+def cold_start_seconds(env, tries=3):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, **env)
+    best = None
+    for _ in range(tries):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, '-c', 'from app import create_app; create_app()'],
+                       cwd=root, env=env, check=True, capture_output=True)
+        seconds = time.perf_counter() - started
+        best = seconds if best is None else min(best, seconds)
+    return round(best, 3)
+
+
+def run_client(env, rows, scenarios, count, warmup):
+    startup = cold_start_seconds(env)
+    os.environ.update(env)
+    from app import create_app
+    from cache import page_cache
+    from facets import facet_cache
+    from io import BytesIO
+    app = create_app()
+    # Entries cached for an earlier database in this process
+    page_cache.clear()
+    facet_cache.clear()
+    client = app.test_client()
+
+    def send(method, path, form, files):
+        if method == 'GET':
+            response = client.get(path)
+        else:
+            data = dict(form)
+            data.update({field: (BytesIO(content), filename) for field, (filename, content) in files.items()})
+            response = client.post(path, data=data, content_type='multipart/form-data')
+        response.get_data()
+        return response.status_code < 400
+
+    results = {}
+    for name in scenarios:
+        for request in scenario_requests(name, warmup, rows, seed=1):
+            send(*request)
+        latencies, errors = [], 0
+        started = time.perf_counter()
+        for request in scenario_requests(name, count, rows):
+            begin = time.perf_counter()
+            ok = send(*request)
+            latencies.append(time.perf_counter() - begin)
+            errors += not ok
+        results[name] = summarise(latencies, time.perf_counter() - started, errors)
+    results['peak_rss_mb'] = own_peak_rss_mb()
+    results['startup_s'] = startup
+    return results
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _multipart(form, files):
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in form.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, (filename, content) in files.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            f'Content-Type: application/octet-stream\r\n\r\n'.encode() + content + b'\r\n'
+        )
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+def run_server(env, rows, scenarios, count, warmup, workers, concurrency):
+    port = _free_port()
+    env = dict(os.environ, **env)
+    # gunicorn.conf.py is picked up from the repo root, so this runs the
+    # production setup (preloaded, warmed-up app)
+    if importlib.util.find_spec('gunicorn'):
+        command = [sys.executable, '-m', 'gunicorn', '--workers', str(workers),
+                   '--bind', f'127.0.0.1:{port}', '--timeout', str(REQUEST_TIMEOUT),
+                   '--log-level', 'warning']
+    else:
+        command = [sys.executable, '-m', 'flask', '--app', 'app:create_app', 'run',
+                   '--port', str(port), '--with-threads']
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    started = time.perf_counter()
+    server = subprocess.Popen(command, cwd=root, env=env)
+    try:
+        # Startup lasts until a worker answers, not just until the port is
+        # open: the master listens before it forks any workers
+        deadline = time.monotonic() + 60
+        while True:
+            try:
+                connection = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+                connection.request('GET', '/cache-stats')
+                connection.getresponse().read()
+                connection.close()
+                break
+            except (OSError, http.client.HTTPException):
+                if server.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError("The server didn't start")
+                time.sleep(0.05)
+        startup = round(time.perf_counter() - started, 3)
+
+        # One keep-alive connection per client thread
+        local = threading.local()
+
+        def send(request):
+            method, path, form, files = request
+            if not hasattr(local, 'connection'):
+                local.connection = http.client.HTTPConnection('127.0.0.1', port, timeout=REQUEST_TIMEOUT)
+            body, headers = None, {}
+            if files:
+                body, content_type = _multipart(form, files)
+                headers['Content-Type'] = content_type
+            begin = time.perf_counter()
+            try:
+                local.connection.request(method, path, body=body, headers=headers)
+                response = local.connection.getresponse()
+                response.read()
+                ok = response.status < 400
+                if response.getheader('Connection', '').lower() == 'close':
+                    local.connection.close()
+                    del local.connection
+            except (OSError, http.client.HTTPException):
+                local.connection.close()
+                del local.connection
+                ok = False
+            return time.perf_counter() - begin, ok
+
+        results = {}
+        with ThreadPoolExecutor(concurrency) as pool:
+            for name in scenarios:
+                list(pool.map(send, scenario_requests(name, warmup, rows, seed=1)))
+                started = time.perf_counter()
+                timings = list(pool.map(send, scenario_requests(name, count, rows)))
+                results[name] = summarise([latency for latency, ok in timings], time.perf_counter() - started,
+                                          sum(not ok for latency, ok in timings))
+        results['peak_rss_mb'] = tree_peak_rss_mb(server.pid)
+        results['startup_s'] = startup
+        return results
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+# Results worse than the baseline by more than tolerance, as messages
+def regressions(results, baseline, tolerance):
+    found = []
+    for name, result in results.items():
+        expected = baseline.get(name)
+        if expected is None or result is None:
+            continue
+        if name == 'peak_rss_mb':
+            if result > expected * (1 + tolerance):
+                found.append(f"peak RSS {result} MB, baseline {expected} MB")
+            continue
+        if name == 'startup_s':
+            if result > expected * (1 + tolerance):
+                found.append(f"startup {result} s, baseline {expected} s")
+            continue
+        # p99 is reported but too noisy over a few hundred requests to fail on
+        for key in ('p50_ms', 'p95_ms'):
+            if result[key] > expected[key] * (1 + tolerance):
+                found.append(f"{name} {key} {result[key]}, baseline {expected[key]}")
+        if result['rps'] < expected['rps'] / (1 + tolerance):
+            found.append(f"{name} throughput {result['rps']} req/s, baseline {expected['rps']}")
+    return found
+
+
+# Results that fail whatever the baseline: failed (or timed out) requests and
+# a p95 over the budget, as messages
+def over_budget(results, budget_ms):
+    found = []
+    for name, result in results.items():
+        if name in ('peak_rss_mb', 'startup_s'):
+            continue
+        if result['errors']:
+            found.append(f"{name} had {result['errors']} failed requests")
+        if result['p95_ms'] > budget_ms:
+            found.append(f"{name} p95_ms {result['p95_ms']}, budget {budget_ms}")
+    return found
+
+
+def print_results(label, results):
+    print(f"\n{label}")
+    print(f"  {'scenario':<16}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>10}{'errors':>8}")
+    for name, result in results.items():
+        if name not in ('peak_rss_mb', 'startup_s'):
+            print(f"  {name:<16}{result['p50_ms']:>10}{result['p95_ms']:>10}{result['p99_ms']:>10}"
+                  f"{result['rps']:>10}{result['errors']:>8}")
+    print(f"  peak RSS: {results['peak_rss_mb']} MB")
+    print(f"  startup: {results['startup_s']} s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the main pages against generated databases")
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000])
+    parser.add_argument('--server', nargs='+', choices=['client', 'gunicorn'], default=['client'])
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument('--requests', type=int, default=200, help="timed requests per scenario")
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--workers', type=int, default=4, help="gunicorn workers")
+    parser.add_argument('--concurrency', type=int, default=8, help="client threads against gunicorn")
+    parser.add_argument('--page-cache', action='store_true',
+                        help="leave the rendered-page cache on (off by default, to time the real work)")
+    parser.add_argument('--data-dir', default='bench_data')
+    parser.add_argument('--baselines', default=BASELINES_PATH)
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument('--p95-budget', type=float, default=P95_BUDGET_MS,
+                        help="slowest p95 allowed for any scenario, in ms")
+    parser.add_argument('--update-baselines', action='store_true',
+                        help="store these results as the new baselines instead of checking them")
+    args = parser.parse_args()
+
+    try:
+        with open(args.baselines) as f:
+            baselines = json.load(f)
+    except FileNotFoundError:
+        baselines = {}
+
+    failures = []
+    for rows in args.rows:
+        data_dir = os.path.abspath(os.path.join(args.data_dir, str(rows)))
+        if not os.path.exists(os.path.join(data_dir, 'database.db')):
+            print(f"Generating a database of {rows} listings in {data_dir}", file=sys.stderr)
+            generate(data_dir, rows)
+
+        for server in args.server:
+            env = run_env(data_dir, scratch_copy(data_dir), args.page_cache)
+            if server == 'client':
+                # The app runs in this process, so its peak RSS includes any
+                # earlier size (or generating the database): run one size at
+                # a time for a clean figure
+                results = run_client(env, rows, args.scenarios, args.requests, args.warmup)
+            else:
+                results = run_server(env, rows, args.scenarios, args.requests, args.warmup,
+                                     args.workers, args.concurrency)
+            key = f'{server}-{rows}'
+            print_results(key, results)
+
+            found = over_budget(results, args.p95_budget)
+            if args.update_baselines:
+                # Results that fail the budget aren't stored
+                if not found:
+                    baselines[key] = results
+            else:
+                found += regressions(results, baselines.get(key, {}), args.tolerance)
+            failures.extend(f"{key}: {message}" for message in found)
+
+    if args.update_baselines:
+        with open(args.baselines, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"\nBaselines written to {args.baselines}")
+    if failures:
+        print("\nRegressions:")
+        for message in failures:
+            print(f"  {message}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,225 @@
+from models import Car_model, Car_stock
+from datetime import datetime
+from sqlalchemy import insert
+import csv
+import dimensions
+import json
+import listings
+import os
+import time
+
+DEFAULT_BATCH_SIZE = 5000
+
+# Columns every imported row needs. "model" may also be given as "car_name",
+# the name the add-listing form uses
+REQUIRED_FIELDS = [
+    'manufacturer', 'bodystyle', 'model', 'horsepower', 'torque', 'eco_rating',
+    'safety_rating', 'seats', 'year', 'price', 'distance',
+]
+
+
+# Raised when an import stops part way. rows_done is how many source rows
+# were committed, which is where a resumed import starts
+class BulkImportError(Exception):
+    def __init__(self, message, rows_done):
+        super().__init__(message)
+        self.rows_done = rows_done
+
+
+# Raised when the rest of a feed can't be read at all, e.g. bytes that
+# aren't UTF-8 in a stream decoded strictly. The rows before it are
+# committed first
+class UnreadableFeed(BulkImportError):
+    pass
+
+
+# Stands in for a JSON line that doesn't parse, so it is skipped and
+# reported like any other bad row
+class UnreadableRow:
+    def __init__(self, error):
+        self.error = error
+
+
+# Whether text decoded with errors='surrogateescape' had bytes that aren't
+# UTF-8
+def _undecodable(text):
+    try:
+        text.encode('utf-8')
+    except UnicodeEncodeError:
+        return True
+    return False
+
+
+# Reads rows one at a time from a CSV (with a header row) or JSON lines text
+# stream, so the whole feed is never held in memory. Open the stream with
+# errors='surrogateescape' and a row with bytes that aren't UTF-8 is
+# skipped as a bad row, instead of stopping the import
+def read_rows(stream, fmt):
+    if fmt == 'csv':
+        for row in csv.DictReader(stream):
+            if any(_undecodable(str(value)) for value in list(row) + list(row.values())):
+                yield UnreadableRow("not UTF-8")
+            else:
+                yield row
+    elif fmt == 'jsonl':
+        for line in stream:
+            if not line.strip():
+                continue
+            if _undecodable(line):
+                yield UnreadableRow("not UTF-8")
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError as e:
+                yield UnreadableRow(f"not valid JSON ({e})")
+    else:
+        raise ValueError(f"Unknown import format: {fmt}")
+
+
+# Guesses the format from a file name, defaulting to CSV
+def format_for(filename):
+    return 'jsonl' if filename.lower().endswith(('.jsonl', '.ndjson', '.json')) else 'csv'
+
+
+# Converts one source row into the values we store, raising ValueError for
+# anything missing or malformed
+def parse_row(row):
+    if isinstance(row, UnreadableRow):
+        raise ValueError(row.error)
+    row = dict(row)
+    if 'model' not in row and 'car_name' in row:
+        row['model'] = row['car_name']
+    missing = [field for field in REQUIRED_FIELDS if row.get(field) in (None, '')]
+    if missing:
+        raise ValueError(f"missing {', '.join(missing)}")
+
+    year = str(row['year'])
+    year = datetime.strptime(year, "%Y-%m-%d" if '-' in year else "%Y").date()
+    return {
+        'manufacturer': str(row['manufacturer']).strip(),
+        'bodystyle': str(row['bodystyle']).strip(),
+        'model': str(row['model']).strip(),
+        'horsepower': int(row['horsepower']),
+        'torque': int(row['torque']),
+        'eco_rating': int(row['eco_rating']),
+        'safety_rating': int(row['safety_rating']),
+        'seats': int(row['seats']),
+        'year': year,
+        'price': int(float(row['price'])),
+        'distance': int(row['distance']),
+    }
+
+
+# Writes one batch of parsed rows as a few multi-row statements: new
+# dimension names, then all the models, then all the stock rows
+def _write_batch(session, batch):
+    manufacturer_ids = dimensions.manufacturers.get_or_create_many(session, [car['manufacturer'] for car in batch])
+    bodystyle_ids = dimensions.bodystyles.get_or_create_many(session, [car['bodystyle'] for car in batch])
+
+    model_ids = session.execute(
+        insert(Car_model).returning(Car_model.model_id, sort_by_parameter_order=True),
+        [{
+            'model_name': car['model'],
+            'model_horsepower': car['horsepower'],
+            'model_torque': car['torque'],
+            'eco_rating': car['eco_rating'],
+            'safety_rating': car['safety_rating'],
+            'model_seats': car['seats'],
+        } for car in batch],
+    ).scalars().all()
+
+    stock_ids = session.execute(
+        insert(Car_stock).returning(Car_stock.stock_id, sort_by_parameter_order=True),
+        [{
+            'manufacturer_id': manufacturer_ids[car['manufacturer']],
+            'bodystyle_id': bodystyle_ids[car['bodystyle']],
+            'model_id': model_id,
+            'year': car['year'],
+            'car_price': car['price'],
+            'distance': car['distance'],
+        } for car, model_id in zip(batch, model_ids)],
+    ).scalars().all()
+
+    listings.listings_written(session, stock_ids)
+    return stock_ids
+
+
+def _save_checkpoint(path, rows_done):
+    if not path:
+        return
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({'rows_done': rows_done}, f)
+    os.replace(tmp_path, path)
+
+
+# Rows already committed by an earlier run, according to its checkpoint file
+def load_checkpoint(path):
+    try:
+        with open(path) as f:
+            return json.load(f)['rows_done']
+    except FileNotFoundError:
+        return 0
+
+
+# Streams rows into the stock tables in batches of batch_size, committing
+# once per batch. The first skip rows are passed over (to resume an import),
+# and after every commit the number of source rows done so far is written to
+# checkpoint_path and passed to progress(stats). Rows that can't be parsed
+# are skipped and reported in stats['errors'] rather than stopping the import.
+# A feed that can't be decoded past some row raises UnreadableFeed once the
+# rows before it are committed
+def import_rows(session, rows, batch_size=DEFAULT_BATCH_SIZE, skip=0, checkpoint_path=None,
+                progress=None, max_errors=100):
+    stats = {'rows_done': skip, 'imported': 0, 'skipped': 0, 'errors': [], 'seconds': 0.0, 'rows_per_sec': 0.0}
+    started = time.perf_counter()
+    batch = []
+    row_number = 0
+
+    def flush():
+        try:
+            _write_batch(session, batch)
+            listings.commit_listings(session)
+        except Exception as e:
+            session.rollback()
+            raise BulkImportError(f"Import stopped after {stats['rows_done']} rows: {e}", stats['rows_done'])
+        stats['imported'] += len(batch)
+        stats['rows_done'] = row_number
+        stats['seconds'] = time.perf_counter() - started
+        stats['rows_per_sec'] = stats['imported'] / stats['seconds'] if stats['seconds'] else 0.0
+        _save_checkpoint(checkpoint_path, row_number)
+        batch.clear()
+        if progress:
+            progress(stats)
+
+    rows = iter(rows)
+    while True:
+        try:
+            row = next(rows)
+        except StopIteration:
+            break
+        except (UnicodeDecodeError, csv.Error) as e:
+            if batch:
+                flush()
+            raise UnreadableFeed(f"Import stopped after {stats['rows_done']} rows: "
+                                 f"row {row_number + 1} can't be read ({e})", stats['rows_done'])
+        row_number += 1
+        if row_number <= skip:
+            continue
+        try:
+            batch.append(parse_row(row))
+        except (ValueError, TypeError, KeyError) as e:
+            stats['skipped'] += 1
+            if len(stats['errors']) < max_errors:
+                stats['errors'].append(f"row {row_number}: {e}")
+            continue
+        if len(batch) >= batch_size:
+            flush()
+
+    if batch:
+        flush()
+    stats['rows_done'] = max(stats['rows_done'], row_number)
+    stats['seconds'] = time.perf_counter() - started
+    stats['rows_per_sec'] = stats['imported'] / stats['seconds'] if stats['seconds'] else 0.0
+    _save_checkpoint(checkpoint_path, stats['rows_done'])
+    return stats
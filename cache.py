@@ -0,0 +1,154 @@
+from collections import OrderedDict
+from flask import current_app, make_response, request
+from functools import wraps
+import os
+import threading
+import time
+
+# Locks the version file between processes; not available on Windows,
+# where the development server runs a single process anyway
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Returned by LRUCache.get for keys that aren't cached
+MISSING = object()
+
+
+# Small thread-safe in-process cache. Holds at most maxsize entries, evicting
+# the least recently used first, and treats entries older than ttl seconds
+# as missing
+class LRUCache:
+    def __init__(self, maxsize=256, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return MISSING
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# Counter shared by every worker process through a small file, bumped
+# whenever the inventory changes. Reading it is one stat() call; the file is
+# only re-read when it has been replaced since the last look
+class VersionCounter:
+    def __init__(self, path):
+        self.path = path
+        self._seen = None
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def current(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return 0
+        key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            if key != self._seen:
+                with open(self.path) as f:
+                    self._value = int(f.read() or 0)
+                self._seen = key
+            return self._value
+
+    # Writes the next value to a temp file and renames it over the old one,
+    # holding a lock file so concurrent bumps from other processes can't
+    # both write the same number
+    def bump(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path + '.lock', 'w') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                with open(self.path) as f:
+                    value = int(f.read() or 0) + 1
+            except FileNotFoundError:
+                value = 1
+            tmp_path = f'{self.path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'w') as f:
+                f.write(str(value))
+            os.replace(tmp_path, self.path)
+        return value
+
+
+_version_counters = {}
+
+
+def _version_counter():
+    path = current_app.config.get('INVENTORY_VERSION_PATH') or os.path.join(current_app.instance_path, 'inventory.version')
+    counter = _version_counters.get(path)
+    if counter is None:
+        counter = _version_counters.setdefault(path, VersionCounter(path))
+    return counter
+
+
+def inventory_version():
+    return _version_counter().current()
+
+
+# Called by the write paths once new listings are committed
+def bump_inventory_version():
+    return _version_counter().bump()
+
+
+# Rendered pages, keyed by (endpoint, query args, inventory version)
+page_cache = LRUCache(maxsize=1024, ttl=300)
+_page_cache_version = None
+
+
+# Serves repeat GETs of a view from page_cache. The key includes the
+# inventory version, and the whole cache is dropped the first time a new
+# version is seen, so pages never outlive the inventory they were built from
+def cached_page(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        global _page_cache_version
+        if request.method != 'GET' or not current_app.config.get('PAGE_CACHE', True):
+            return view(*args, **kwargs)
+
+        version = inventory_version()
+        if version != _page_cache_version:
+            page_cache.clear()
+            _page_cache_version = version
+
+        key = (request.endpoint, tuple(sorted(request.args.items(multi=True))), version)
+        cached = page_cache.get(key)
+        if cached is not MISSING:
+            body, status, headers = cached
+            response = current_app.response_class(body, status, headers)
+            response.headers['X-Cache'] = 'HIT'
+            return response
+
+        response = make_response(view(*args, **kwargs))
+        if response.status_code == 200 and not response.direct_passthrough:
+            page_cache.set(key, (response.get_data(), response.status_code, list(response.headers.items())))
+        response.headers['X-Cache'] = 'MISS'
+        return response
+    return wrapper
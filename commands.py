@@ -0,0 +1,197 @@
+from assets import build_assets
+from bulk_import import BulkImportError, DEFAULT_BATCH_SIZE, format_for, import_rows, load_checkpoint, read_rows
+from cache import bump_inventory_version
+from image_store import get_image_store, sniff_mimetype
+from query_plans import check_query_plans
+from sqlalchemy import text
+from models import car_images
+from variants import build_variants
+import analytics
+import click
+import listing_view
+import os
+import random
+import search
+import similar
+import time
+
+
+# Registering command line tools to the app (run with "flask <command>")
+def register_commands(app, db):
+
+    # Rebuilds the full-text search index from the stock tables
+    @app.cli.command('rebuild-search')
+    def rebuild_search():
+        count = search.rebuild_search_index(db.session)
+        db.session.commit()
+        click.echo(f"Indexed {count} sets of names for search")
+
+    # Rebuilds the denormalized listing table the inventory page reads
+    @app.cli.command('rebuild-listing-view')
+    def rebuild_listing_view():
+        count = listing_view.rebuild_listing_view(db.session)
+        db.session.commit()
+        bump_inventory_version()
+        click.echo(f"Rebuilt {count} listings")
+
+    # Moves image blobs out of car_images and into the image store. Safe to
+    # stop and re-run: each batch is committed, and migrated rows are skipped
+    @app.cli.command('migrate-images')
+    @click.option('--batch-size', default=200, show_default=True, help='Images moved per transaction.')
+    @click.option('--vacuum', is_flag=True, help='VACUUM afterwards to give the freed space back to the OS.')
+    def migrate_images(batch_size, vacuum):
+        # The image_hash and image_mimetype columns come from the migrations
+        # (run by create_app, or with "flask db upgrade")
+        image_store = get_image_store()
+        moved = 0
+        last_id = 0
+        while True:
+            rows = db.session.execute(
+                text("SELECT image_id, image FROM car_images "
+                     "WHERE image_id > :last_id AND image IS NOT NULL "
+                     "ORDER BY image_id LIMIT :limit"),
+                {'last_id': last_id, 'limit': batch_size},
+            ).all()
+            if not rows:
+                break
+
+            for image_id, data in rows:
+                # Empty blobs were stored when no image was uploaded
+                image_hash = image_store.put(data) if data else None
+                image_mimetype = sniff_mimetype(data) if data else None
+                db.session.execute(
+                    text("UPDATE car_images SET image_hash = :image_hash, image_mimetype = :image_mimetype, "
+                         "image = NULL WHERE image_id = :image_id"),
+                    {'image_hash': image_hash, 'image_mimetype': image_mimetype, 'image_id': image_id},
+                )
+            db.session.commit()
+
+            moved += len(rows)
+            last_id = rows[-1].image_id
+            click.echo(f"Moved {moved} images")
+
+        if vacuum:
+            with db.engine.connect() as connection:
+                connection.execute(text("VACUUM"))
+        click.echo(f"Done, {moved} images moved to {image_store.root}")
+
+    # Builds the resized copies of every stored image that doesn't have them
+    # yet, e.g. after migrate-images or for uploads made before variants
+    @app.cli.command('build-variants')
+    def build_variants_command():
+        image_store = get_image_store()
+        digests = db.session.query(car_images.image_hash) \
+            .filter(car_images.image_hash.isnot(None)) \
+            .distinct()
+        built = 0
+        for (digest,) in digests:
+            if image_store.exists(digest):
+                built += build_variants(image_store, digest)
+        click.echo(f"Built {built} image variants")
+
+    # Bulk loads cars from a CSV or JSON lines file. Progress is checkpointed
+    # after every batch, so a failed import can be continued with --resume
+    @app.cli.command('import-cars')
+    @click.argument('path', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), help='Defaults to the file extension.')
+    @click.option('--batch-size', default=DEFAULT_BATCH_SIZE, show_default=True, help='Rows per transaction.')
+    @click.option('--resume', is_flag=True, help='Skip the rows committed by an earlier, failed run.')
+    def import_cars(path, fmt, batch_size, resume):
+        checkpoint_path = path + '.checkpoint'
+        skip = load_checkpoint(checkpoint_path) if resume else 0
+        if skip:
+            click.echo(f"Resuming after row {skip}")
+
+        def progress(stats):
+            click.echo(f"{stats['rows_done']} rows, {stats['rows_per_sec']:.0f} rows/sec")
+
+        with open(path, newline='', encoding='utf-8', errors='surrogateescape') as f:
+            try:
+                stats = import_rows(db.session, read_rows(f, fmt or format_for(path)), batch_size=batch_size,
+                                    skip=skip, checkpoint_path=checkpoint_path, progress=progress)
+            except BulkImportError as e:
+                raise click.ClickException(f"{e}\nRun again with --resume to continue from row {e.rows_done}.")
+        os.remove(checkpoint_path)
+
+        for error in stats['errors']:
+            click.echo(f"Skipped {error}", err=True)
+        click.echo(f"Imported {stats['imported']} cars ({stats['skipped']} skipped) "
+                   f"in {stats['seconds']:.1f}s, {stats['rows_per_sec']:.0f} rows/sec")
+
+    # Builds the fingerprinted, precompressed copies of the static files and
+    # mirrors the remote images the pages use into static/dist
+    @app.cli.command('build-assets')
+    @click.option('--no-mirror', is_flag=True, help="Keep the mirrored images from the last build instead of downloading them.")
+    def build_assets_command(no_mirror):
+        manifest = build_assets(app.static_folder, mirror=not no_mirror)
+        click.echo(f"Built {len(manifest)} assets")
+
+    # Works out the analytics rollups again from car_stock and reports any
+    # row that differs from the stored ones. --fix replaces them with the
+    # recomputed ones
+    @app.cli.command('check-analytics')
+    @click.option('--fix', is_flag=True, help='Rebuild the rollups from car_stock.')
+    def check_analytics(fix):
+        started = time.perf_counter()
+        differences = analytics.check_rollups(db.session)
+        for table, key, stored, expected in differences[:20]:
+            click.echo(f"DIFF  {table} {key}: stored {stored}, car_stock {expected}")
+        click.echo(f"{len(differences)} rollup rows differ from car_stock "
+                   f"(checked in {time.perf_counter() - started:.2f} s)")
+        if fix:
+            analytics.rebuild_rollups(db.session)
+            db.session.commit()
+            click.echo("Rebuilt the rollups")
+        elif differences:
+            raise click.ClickException("The rollups don't match car_stock, rebuild them with --fix")
+
+    # Compares /cars/<id>/similar with the brute-force reference for a random
+    # sample of cars, and times both
+    @app.cli.command('check-similar')
+    @click.option('--samples', default=20, show_default=True, help='Cars to check.')
+    @click.option('--limit', default=similar.DEFAULT_SIMILAR, show_default=True, help='Similar cars per check.')
+    @click.option('--seed', default=0, show_default=True)
+    def check_similar(samples, limit, seed):
+        index = similar.get_index(db.session)
+        count, stock_ids = index.matrix[:2]
+        stock_ids = stock_ids[:count].tolist()
+        if not stock_ids:
+            raise click.ClickException("There are no cars to check")
+        rng = random.Random(seed)
+        failed = 0
+        fast_time = slow_time = 0.0
+        for stock_id in rng.sample(stock_ids, min(samples, len(stock_ids))):
+            started = time.perf_counter()
+            found = similar.similar_cars(db.session, stock_id, limit)
+            fast_time += time.perf_counter() - started
+            started = time.perf_counter()
+            expected = similar.similar_cars_brute_force(db.session, stock_id, limit)
+            slow_time += time.perf_counter() - started
+            # The fast path works in float32, so cars at (almost) the same
+            # distance may come out in either order
+            same = len(found) == len(expected) and all(
+                found_id == expected_id or abs(found_score - expected_score) <= 1e-4 * (1 + expected_score)
+                for (found_id, found_score), (expected_id, expected_score) in zip(found, expected)
+            )
+            if not same:
+                failed += 1
+                click.echo(f"FAIL  {stock_id}: {found} != {expected}")
+        checked = min(samples, len(stock_ids))
+        click.echo(f"Checked {checked} cars out of {len(stock_ids)}: "
+                   f"{fast_time / checked * 1000:.2f} ms per query, "
+                   f"{slow_time / checked * 1000:.0f} ms brute force")
+        if failed:
+            raise click.ClickException(f"{failed} cars had different similar cars")
+
+    # Prints the EXPLAIN QUERY PLAN of the main inventory and image queries and
+    # fails if any of them scans listing_view or sorts rows instead of using an index
+    @app.cli.command('check-query-plans')
+    def check_query_plans_command():
+        failed = False
+        for name, plan, problems in check_query_plans(db.session):
+            click.echo(f"{'FAIL' if problems else 'ok'}  {name}")
+            for step in plan:
+                click.echo(f"      {step}")
+            failed = failed or bool(problems)
+        if failed:
+            raise click.ClickException("Some queries don't use the indexes")
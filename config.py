@@ -0,0 +1,61 @@
+from image_store import DEFAULT_IMAGE_TYPES
+import os
+
+# Settings for each way the app is run. create_app picks one by name (or
+# from the APP_CONFIG environment variable), then any setting can still be
+# overridden from a FLASK_ environment variable, e.g.
+# FLASK_SQLALCHEMY_DATABASE_URI=sqlite:////tmp/other.db
+
+
+class Config:
+    # None means database.db in the instance folder
+    SQLALCHEMY_DATABASE_URI = None
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Bring the database schema up to date when the app starts
+    AUTO_MIGRATE = True
+    # Largest request body, which bounds an add-listing upload; bulk imports
+    # have their own limit (None for no limit)
+    MAX_CONTENT_LENGTH = 16 * 1024 * 1024
+    MAX_IMPORT_SIZE = None
+    # Largest photo and the photo types accepted with a listing
+    MAX_IMAGE_SIZE = 10 * 1024 * 1024
+    IMAGE_TYPES = DEFAULT_IMAGE_TYPES
+    # Compile the templates and run the main queries once when the app is
+    # created. gunicorn.conf.py does this in the master instead, so every
+    # worker it forks starts warm
+    WARM_UP = False
+
+
+class DevelopmentConfig(Config):
+    SERVER_TIMING = True
+
+
+# Run under gunicorn with gunicorn.conf.py. Migrations are run once by the
+# master (preload_app), and templates aren't checked for changes
+class ProductionConfig(Config):
+    TEMPLATES_AUTO_RELOAD = False
+    SERVER_TIMING = False
+
+
+# A throwaway in-memory database, built by the migrations, and no caching
+# between requests
+class TestingConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+    PAGE_CACHE = False
+
+
+CONFIGS = {
+    'development': DevelopmentConfig,
+    'production': ProductionConfig,
+    'testing': TestingConfig,
+}
+DEFAULT_CONFIG = 'development'
+
+
+def config_for(name=None):
+    name = name or os.environ.get('APP_CONFIG') or DEFAULT_CONFIG
+    try:
+        return CONFIGS[name]
+    except KeyError:
+        raise ValueError(f"Unknown config {name!r}, expected one of {', '.join(CONFIGS)}")
@@ -0,0 +1,136 @@
+from flask import current_app, g, has_request_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, event
+from urllib.request import pathname2url
+import os
+import weakref
+
+# Pragmas set on every new SQLite connection, as (config key, pragma,
+# default). A setting of None leaves SQLite's own default
+SQLITE_PRAGMAS = [
+    # Readers and the writer don't block each other, and a commit is one
+    # append to the log instead of rewriting pages through a rollback journal
+    ('SQLITE_JOURNAL_MODE', 'journal_mode', 'wal'),
+    # Wait for a lock this many milliseconds before "database is locked"
+    ('SQLITE_BUSY_TIMEOUT', 'busy_timeout', 5000),
+    # In WAL mode NORMAL only syncs at checkpoints; a power cut can lose the
+    # last commits but never corrupts the database
+    ('SQLITE_SYNCHRONOUS', 'synchronous', 'normal'),
+    # Page cache per connection; negative values are in KiB (64 MiB)
+    ('SQLITE_CACHE_SIZE', 'cache_size', -65536),
+    # Reads go through a shared memory map instead of read() calls (256 MiB)
+    ('SQLITE_MMAP_SIZE', 'mmap_size', 268435456),
+]
+# Pragmas that change the database file rather than the connection, and so
+# can't be set on a read-only connection
+FILE_PRAGMAS = {'journal_mode'}
+
+# Every engine made by configure_database, so a forked worker can drop the
+# connections it inherited
+_engines = weakref.WeakSet()
+
+
+def _pragma_statements(config, read_only):
+    statements = []
+    for key, pragma, default in SQLITE_PRAGMAS:
+        value = config.get(key, default)
+        if value is None or (read_only and pragma in FILE_PRAGMAS):
+            continue
+        statements.append(f"PRAGMA {pragma} = {value}")
+    if read_only:
+        # Belt and braces: a stray write fails instead of taking the lock
+        statements.append("PRAGMA query_only = ON")
+    return statements
+
+
+def _set_pragmas(engine, statements):
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for statement in statements:
+                cursor.execute(statement)
+        finally:
+            cursor.close()
+
+
+# A second engine on the same SQLite file, opened read-only, with its own
+# connection pool. None for databases that aren't a file
+def _read_only_engine(app, engine):
+    url = engine.url
+    if url.get_backend_name() != 'sqlite' or url.database in (None, '', ':memory:'):
+        return None
+    path = 'file:' + pathname2url(os.path.abspath(url.database))
+    return create_engine(
+        url.set(database=path, query={'mode': 'ro', 'uri': 'true'}),
+        pool_size=app.config['READ_POOL_SIZE'],
+        max_overflow=app.config['READ_POOL_OVERFLOW'],
+    )
+
+
+# Sets the connection pragmas on the app's engine and, unless READ_ONLY_ENGINE
+# is False, adds a read-only engine that GET requests use. A GET view that
+# writes must be marked with @writes_database
+def configure_database(app, db):
+    for key, pragma, default in SQLITE_PRAGMAS:
+        app.config.setdefault(key, default)
+    app.config.setdefault('READ_ONLY_ENGINE', True)
+    app.config.setdefault('READ_POOL_SIZE', 5)
+    app.config.setdefault('READ_POOL_OVERFLOW', 10)
+
+    with app.app_context():
+        engine = db.engine
+    if engine.url.get_backend_name() != 'sqlite':
+        return
+    _set_pragmas(engine, _pragma_statements(app.config, read_only=False))
+    _engines.add(engine)
+
+    if app.config['READ_ONLY_ENGINE']:
+        read_engine = _read_only_engine(app, engine)
+        if read_engine is not None:
+            _set_pragmas(read_engine, _pragma_statements(app.config, read_only=True))
+            _engines.add(read_engine)
+            app.extensions['read_only_engine'] = read_engine
+
+    @app.before_request
+    def choose_engine():
+        view = app.view_functions.get(request.endpoint)
+        g.read_only = request.method in ('GET', 'HEAD') and not getattr(view, 'writes_database', False)
+
+
+# Marks a GET view that writes, so its requests use the read-write engine
+def writes_database(view):
+    view.writes_database = True
+    return view
+
+
+# db.session's class. Sends everything a read-only request runs to the
+# read-only engine; flushes, and every request that may write, use the
+# app's own engine
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and has_request_context() and g.get('read_only'):
+            read_engine = current_app.extensions.get('read_only_engine')
+            if read_engine is not None:
+                return read_engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+# Empties the connection pools of every engine. close=False drops the
+# connections without closing them, for a child process whose connections
+# still belong to its parent
+def dispose_engines(close=True):
+    for engine in list(_engines):
+        engine.dispose(close=close)
+
+
+# A forked worker (gunicorn with preload_app) starts with copies of the
+# parent's pooled connections. Using a SQLite connection from two processes
+# corrupts its state, so the child empties its pools without closing the
+# parent's connections, and opens its own as needed
+def _dispose_after_fork():
+    dispose_engines(close=False)
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_dispose_after_fork)
@@ -0,0 +1,81 @@
+from models import Car_manufacturer, Car_bodystyle
+from sqlalchemy import event, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+from weakref import WeakKeyDictionary
+import threading
+
+
+# In-process name -> id lookup for a small dimension table (manufacturers,
+# bodystyles). Names are unique in the database and rows are never deleted,
+# so a cached id stays right for the life of the process. Misses insert the
+# name with INSERT ... ON CONFLICT DO NOTHING and read the id back in the
+# caller's transaction, so two workers adding the same new name end up with
+# one row. Ids of rows created in a transaction are only cached once it
+# commits
+class DimensionCache:
+    def __init__(self, model, name_column, id_column):
+        self.model = model
+        self.name_column = name_column
+        self.id_column = id_column
+        # One map per engine, so apps on different databases don't mix ids
+        self._ids = WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def _cache_for(self, session):
+        engine = session.get_bind()
+        with self._lock:
+            return self._ids.setdefault(engine, {})
+
+    def get_or_create(self, session, name):
+        return self.get_or_create_many(session, [name])[name]
+
+    # Resolves many names with at most one insert and one select
+    def get_or_create_many(self, session, names):
+        cache = self._cache_for(session)
+        found = {name: cache[name] for name in set(names) if name in cache}
+        missing = sorted(set(names) - found.keys())
+        if not missing:
+            return found
+
+        inserted = session.execute(
+            insert(self.model).on_conflict_do_nothing(index_elements=[self.name_column])
+            .returning(self.name_column),
+            [{self.name_column.key: name} for name in missing],
+        ).scalars().all()
+        ids = dict(session.execute(
+            select(self.name_column, self.id_column).where(self.name_column.in_(missing))
+        ).tuples().all())
+        found.update(ids)
+
+        # Rows that already existed are safe to cache now, new ones wait
+        # for the transaction to commit
+        inserted = set(inserted)
+        pending = session.info.setdefault('pending_dimensions', [])
+        for name, row_id in ids.items():
+            if name in inserted:
+                pending.append((cache, name, row_id))
+            else:
+                cache[name] = row_id
+        return found
+
+    def clear(self):
+        with self._lock:
+            self._ids.clear()
+
+
+manufacturers = DimensionCache(Car_manufacturer, Car_manufacturer.manufacturer_name, Car_manufacturer.manufacturer_id)
+bodystyles = DimensionCache(Car_bodystyle, Car_bodystyle.bodystyle_name, Car_bodystyle.bodystyle_id)
+
+
+# Caches the names created by a transaction once it has committed, and
+# forgets them if it is rolled back. Registered for every session
+@event.listens_for(Session, 'after_commit')
+def commit_pending(session):
+    for cache, name, row_id in session.info.pop('pending_dimensions', []):
+        cache[name] = row_id
+
+
+@event.listens_for(Session, 'after_rollback')
+def discard_pending(session):
+    session.info.pop('pending_dimensions', None)
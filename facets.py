@@ -0,0 +1,113 @@
+from models import Listing_view
+from cache import LRUCache, MISSING, inventory_version
+from sqlalchemy import bindparam, func, literal, text
+import analytics
+import inventory
+import search
+
+# Facets shown next to the inventory, in display order, as
+# (facet name, column counted by, column shown, filter the facet leaves out)
+FACETS = [
+    ('manufacturer', Listing_view.manufacturer_id, Listing_view.manufacturer_name, 'manufacturer'),
+    ('bodystyle', Listing_view.bodystyle_id, Listing_view.bodystyle_name, 'bodystyle'),
+    ('seats', Listing_view.model_seats, Listing_view.model_seats, 'seats'),
+    ('eco_rating', Listing_view.eco_rating, Listing_view.eco_rating, 'eco_min'),
+    ('safety_rating', Listing_view.safety_rating, Listing_view.safety_rating, 'safety_min'),
+]
+
+# Counts for recent search + filter combinations. Keyed by the inventory
+# version, so a write in any process makes the old counts unreachable
+facet_cache = LRUCache(maxsize=512, ttl=30)
+# Most cars a facet is counted over. When the search and filters leave
+# more, the facet lists its values without counts rather than grouping a
+# large part of the inventory on every request
+FACET_COUNT_LIMIT = 10000
+
+
+# Counts of the whole inventory from facet_rollup, which the write paths
+# keep up to date, for the facets given. Labels come from the dimension
+# tables; the numeric facets are their own labels
+def _rollup_counts(session, facets):
+    labels = {facet: dict(session.execute(text(analytics.GROUP_LABELS[facet])).all())
+              for facet in facets if facet in analytics.GROUP_LABELS}
+    rows = session.execute(
+        text("SELECT dimension, group_key, listing_count FROM facet_rollup WHERE dimension IN :facets")
+        .bindparams(bindparam('facets', expanding=True)),
+        {'facets': list(facets)},
+    )
+    for facet, value, count in rows:
+        label = labels[facet].get(value) if facet in labels else value
+        if label is not None:
+            yield facet, value, label, count
+
+
+# Counts the cars for every value of every facet. Each facet is counted
+# with all the active filters except its own, so a ticked "SUV" still shows
+# how many sedans there are. A facet nothing else narrows is read from the
+# rollup. The rest are counted in one UNION ALL of GROUP BYs over the cars
+# the search and filters leave, if there are at most FACET_COUNT_LIMIT of
+# them; otherwise their values are listed with a count of None
+def _count_facets(session, search_text, filters):
+    searching = bool(search.match_expression(search_text))
+    queries = []
+    unfiltered = []
+    uncounted = []
+    # Whether the cars left by a set of filters are few enough to count
+    countable = {}
+    for facet, column, label, skip in FACETS:
+        applied = frozenset(name for name in filters if name != skip)
+        if not searching and not applied:
+            unfiltered.append(facet)
+            continue
+        if applied not in countable:
+            matching = inventory.apply_search(session.query(Listing_view.stock_id), search_text, with_rank=False)
+            matching = inventory.apply_filters(matching, filters, skip=skip).limit(FACET_COUNT_LIMIT + 1)
+            countable[applied] = session.query(func.count()).select_from(matching.subquery()).scalar() \
+                <= FACET_COUNT_LIMIT
+        if not countable[applied]:
+            uncounted.append(facet)
+            continue
+        # Grouped by column + 0, which no index covers: otherwise SQLite
+        # walks e.g. the whole manufacturer index for the grouping order
+        # instead of using the index of a narrow filter
+        value = (column + 0).label('value')
+        query = session.query(
+            literal(facet).label('facet'),
+            value,
+            label.label('label'),
+            func.count().label('count'),
+        )
+        query = inventory.apply_search(query, search_text, with_rank=False)
+        query = inventory.apply_filters(query, filters, skip=skip)
+        queries.append(query.group_by(value, label))
+
+    counts = {facet: [] for facet, column, label, skip in FACETS}
+    if unfiltered or uncounted:
+        for facet, value, label, count in _rollup_counts(session, unfiltered + uncounted):
+            counts[facet].append((value, label, count))
+    if queries:
+        for row in queries[0].union_all(*queries[1:]).all():
+            if row.value is not None:
+                counts[row.facet].append((row.value, row.label, row.count))
+    for facet in counts:
+        counts[facet].sort(key=lambda value: (-value[2], str(value[1])))
+    # Uncounted facets keep the order of their whole-inventory counts
+    for facet in uncounted:
+        counts[facet] = [(value, label, None) for value, label, count in counts[facet]]
+    return counts
+
+
+# {facet: [(value, label, count)]}, most common values first. count is None
+# for facets over too many cars to count, see _count_facets
+def facet_counts(session, search_text, filters):
+    key = (inventory_version(), search.match_expression(search_text), tuple(sorted(filters.items())))
+    counts = facet_cache.get(key)
+    if counts is MISSING:
+        counts = _count_facets(session, search_text, filters)
+        facet_cache.set(key, counts)
+    return counts
+
+
+# Called after listings are written so the counts are worked out again
+def invalidate():
+    facet_cache.clear()
@@ -0,0 +1,80 @@
+from datetime import date
+import inventory
+import json
+
+# Rows fetched from the database cursor at a time while streaming. Each batch
+# is also written to the client as one chunk
+FEED_BATCH_SIZE = 1000
+
+FEED_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'json': 'application/json',
+}
+
+
+# The public shape of one listing row. Plain values only, no ORM objects
+def feed_record(row):
+    return {
+        'stock_id': row.stock_id,
+        'manufacturer': row.manufacturer_name,
+        'model': row.model_name,
+        'year': row.year.year if isinstance(row.year, date) else row.year,
+        'price': row.car_price,
+        'distance': row.distance,
+        'image_id': row.image_id,
+    }
+
+
+def _dumps(value):
+    return json.dumps(value, separators=(',', ':'))
+
+
+# Runs the query with a server-side cursor and yields its rows in batches of
+# FEED_BATCH_SIZE, so memory stays flat however many rows match. With a
+# limit (at least 1), one extra row is read to tell whether there are more;
+# if there are, the cursor to carry on from is yielded last, as a string
+def _batches(session, query, sort, descending, limit):
+    if limit is not None:
+        query = query.limit(limit + 1)
+    result = session.execute(query.statement.execution_options(yield_per=FEED_BATCH_SIZE))
+
+    remaining = limit
+    last = None
+    for batch in result.partitions():
+        if remaining is not None and len(batch) > remaining:
+            batch = batch[:remaining]
+            if batch:
+                yield batch
+                last = batch[-1]
+            result.close()
+            yield inventory.encode_cursor(sort, descending, last)
+            return
+        if remaining is not None:
+            remaining -= len(batch)
+        last = batch[-1]
+        yield batch
+
+
+# One JSON object per line. When the limit cut the results short, a final
+# {"next_cursor": ...} line says where to carry on
+def stream_ndjson(session, query, sort, descending, limit=None):
+    for batch in _batches(session, query, sort, descending, limit):
+        if isinstance(batch, str):
+            yield _dumps({'next_cursor': batch}) + '\n'
+        else:
+            yield ''.join(_dumps(feed_record(row)) + '\n' for row in batch)
+
+
+# A single {"cars": [...], "next_cursor": ...} document, written as it is read
+def stream_json(session, query, sort, descending, limit=None):
+    yield '{"cars":['
+    first = True
+    next_cursor = None
+    for batch in _batches(session, query, sort, descending, limit):
+        if isinstance(batch, str):
+            next_cursor = batch
+            continue
+        chunk = ','.join(_dumps(feed_record(row)) for row in batch)
+        yield chunk if first else ',' + chunk
+        first = False
+    yield '],"next_cursor":' + _dumps(next_cursor) + '}\n'
@@ -0,0 +1,44 @@
+# Production settings for gunicorn, which reads this file from the working
+# directory:
+#
+#     gunicorn
+#
+# The app is built once in the master (preload_app): migrations run there,
+# templates are compiled and the main queries warmed up, and every worker is
+# forked with all of that already in memory. database.py drops the pooled
+# SQLite connections in each forked worker, so no two processes share one
+import multiprocessing
+import os
+import time
+
+wsgi_app = "app:create_app('production')"
+bind = os.environ.get('GUNICORN_BIND', '127.0.0.1:8000')
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+preload_app = True
+timeout = 60
+
+# When the master started, for the cold start time
+_started = time.perf_counter()
+
+
+# Runs in the master once the app is loaded and before any worker is forked
+def when_ready(server):
+    if not server.cfg.preload_app:
+        return
+    from app import warm_up
+    app = server.app.wsgi()
+    warm_up(app)
+    server.log.info("App ready in %.0f ms", (time.perf_counter() - _started) * 1000)
+
+
+def pre_fork(server, worker):
+    worker.spawn_started = time.perf_counter()
+
+
+# Runs in each worker once it can take requests. Reported at /metrics as
+# app_startup_seconds{phase="worker_spawn"}
+def post_worker_init(worker):
+    from metrics import request_metrics
+    seconds = time.perf_counter() - worker.spawn_started
+    request_metrics.startup('worker_spawn', seconds)
+    worker.log.info("Worker %s ready in %.1f ms", worker.pid, seconds * 1000)
@@ -0,0 +1,131 @@
+from flask import current_app
+from io import BytesIO
+import hashlib
+import os
+import tempfile
+
+# Bytes read from an upload at a time, which bounds the memory one upload uses
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+
+# Raised when an upload is refused, with the HTTP status to answer with
+class ImageRejected(Exception):
+    def __init__(self, message, status_code):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+# Content-addressed file store for car images. Each image is saved once
+# under the SHA-256 of its bytes, so identical uploads share one file and
+# a stored file never changes after it is written
+class ImageStore:
+    def __init__(self, root):
+        self.root = root
+
+    # Files are fanned out over two directory levels (ab/cd/abcd...) so no
+    # single directory ends up with hundreds of thousands of entries
+    def path_for(self, digest):
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def exists(self, digest):
+        return os.path.exists(self.path_for(digest))
+
+    # Resized copies of an image live under variants/<size>/ with the same
+    # fan-out, keyed by the digest of the original
+    def variant_path(self, digest, size):
+        return os.path.join(self.root, 'variants', size, digest[:2], digest[2:4], digest + '.jpg')
+
+    # Saves the bytes and returns their digest
+    def put(self, data):
+        digest = hashlib.sha256(data).hexdigest()
+        if self.exists(digest):
+            return digest
+        return self.put_stream(BytesIO(data))[0]
+
+    # Copies a file-like object into the store a chunk at a time, hashing as
+    # it goes, and returns (digest, sniffed mimetype). Writing to a temp file
+    # and renaming it into place means readers never see a half-written
+    # image. Raises ImageRejected, before writing anything more, once the
+    # upload is bigger than max_size bytes or its type isn't in allowed_types
+    def put_stream(self, stream, max_size=None, allowed_types=None):
+        os.makedirs(self.root, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix='.upload-')
+        try:
+            digest = hashlib.sha256()
+            size = 0
+            mimetype = None
+            with os.fdopen(fd, 'wb') as tmp:
+                while True:
+                    chunk = stream.read(UPLOAD_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    if mimetype is None:
+                        mimetype = sniff_mimetype(chunk)
+                        if allowed_types is not None and mimetype not in allowed_types:
+                            raise ImageRejected("The image must be one of: " + ", ".join(allowed_types), 415)
+                    size += len(chunk)
+                    if max_size is not None and size > max_size:
+                        raise ImageRejected(f"The image is bigger than {size_label(max_size)}", 413)
+                    digest.update(chunk)
+                    tmp.write(chunk)
+            if mimetype is None:
+                raise ImageRejected("The image is empty", 400)
+
+            digest = digest.hexdigest()
+            path = self.path_for(digest)
+            if os.path.exists(path):
+                os.unlink(tmp_path)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        return digest, mimetype
+
+
+# A byte count for messages, e.g. "10 MB" or "200 KB"
+def size_label(size):
+    if size >= 1024 * 1024:
+        return f"{size / (1024 * 1024):.3g} MB"
+    return f"{size / 1024:.3g} KB"
+
+
+# Magic numbers of the image formats browsers can show, as (offset, bytes)
+IMAGE_SIGNATURES = [
+    ('image/jpeg', [(0, b'\xff\xd8\xff')]),
+    ('image/png', [(0, b'\x89PNG\r\n\x1a\n')]),
+    ('image/gif', [(0, b'GIF87a')]),
+    ('image/gif', [(0, b'GIF89a')]),
+    ('image/webp', [(0, b'RIFF'), (8, b'WEBP')]),
+    ('image/avif', [(4, b'ftypavif')]),
+    ('image/bmp', [(0, b'BM')]),
+]
+
+# How many leading bytes sniff_mimetype needs to see
+SNIFF_LENGTH = 16
+
+# Types accepted for listing photos unless IMAGE_TYPES is configured
+DEFAULT_IMAGE_TYPES = ('image/jpeg', 'image/png', 'image/gif', 'image/webp', 'image/avif')
+
+
+# Works out the image type from the file contents rather than trusting the
+# upload's filename or Content-Type
+def sniff_mimetype(head):
+    for mimetype, checks in IMAGE_SIGNATURES:
+        if all(head[offset:offset + len(magic)] == magic for offset, magic in checks):
+            return mimetype
+    return 'application/octet-stream'
+
+
+def sniff_file_mimetype(path):
+    with open(path, 'rb') as f:
+        return sniff_mimetype(f.read(SNIFF_LENGTH))
+
+
+# The store for the current app, kept in the instance folder unless
+# IMAGE_STORE_PATH is configured
+def get_image_store():
+    root = current_app.config.get('IMAGE_STORE_PATH') or os.path.join(current_app.instance_path, 'images')
+    return ImageStore(root)
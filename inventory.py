@@ -0,0 +1,293 @@
+from models import Listing_view
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import date
+from sqlalchemy import and_, asc, desc, literal_column, tuple_
+import json
+import search
+
+# Page sizes for the inventory listing
+DEFAULT_PAGE_SIZE = 25
+MAX_PAGE_SIZE = 100
+
+# Columns the inventory can be sorted by. stock_id is always used as the
+# tie-breaker, so every row has a unique position in the ordering
+SORT_KEYS = {
+    'price': Listing_view.car_price,
+    'year': Listing_view.year,
+    'distance': Listing_view.distance,
+    'stock_id': Listing_view.stock_id,
+    # Only available when searching, see apply_search
+    'relevance': literal_column('search_rank'),
+}
+DEFAULT_SORT = 'price'
+DEFAULT_SEARCH_SORT = 'relevance'
+# The JSON types a cursor's sort value can have for each sort key: years are
+# ISO dates, and ranks are floats (or ints, if a rank is a whole number)
+CURSOR_VALUE_TYPES = {
+    'price': int,
+    'year': str,
+    'distance': int,
+    'stock_id': int,
+    'relevance': (int, float),
+}
+
+# Filters that match any of several values, e.g. ?manufacturer=1&manufacturer=3
+LIST_FILTERS = {
+    'manufacturer': Listing_view.manufacturer_id,
+    'bodystyle': Listing_view.bodystyle_id,
+    'seats': Listing_view.model_seats,
+}
+
+# Filters on a range, given as <name>_min and/or <name>_max
+RANGE_FILTERS = {
+    'price': Listing_view.car_price,
+    'year': Listing_view.year,
+    'distance': Listing_view.distance,
+}
+
+# Filters for a lowest acceptable rating, e.g. ?eco_min=4
+MIN_FILTERS = {
+    'eco_min': Listing_view.eco_rating,
+    'safety_min': Listing_view.safety_rating,
+}
+
+# Years a year filter can be turned into a date for
+MIN_YEAR = 1
+MAX_YEAR = 9998
+# SQLite integers are signed 64-bit; filter values outside that are ignored
+MIN_FILTER_VALUE = -2 ** 63
+MAX_FILTER_VALUE = 2 ** 63 - 1
+
+
+# One page of listing rows plus the cursors needed to move either way
+class Page:
+    def __init__(self, rows, next_cursor=None, prev_cursor=None):
+        self.rows = rows
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+
+# Only selects the columns the inventory page shows, so no ORM objects
+# (or image blobs) are built for the listing. listing_view has the names
+# joined in already, so this reads a single table
+def listing_query(session):
+    return session.query(
+        Listing_view.stock_id,
+        Listing_view.manufacturer_name,
+        Listing_view.model_name,
+        Listing_view.year,
+        Listing_view.car_price,
+        Listing_view.distance,
+        Listing_view.image_id,
+    )
+
+
+# Filter on manufacturer, model or bodystyle name through the full-text
+# index, and expose the match rank so results can be sorted by relevance
+def apply_search(query, search_text, with_rank=True):
+    match = search.match_expression(search_text)
+    if not match:
+        return query
+    matches = search.search_matches(match)
+    query = query.join(matches, and_(
+        matches.c.manufacturer_name == Listing_view.manufacturer_name,
+        matches.c.model_name == Listing_view.model_name,
+        matches.c.bodystyle_name == Listing_view.bodystyle_name,
+    ))
+    if with_rank:
+        query = query.add_columns(matches.c.search_rank)
+    return query
+
+
+# A filter value as an int, or None if it isn't a whole number SQLite can
+# compare with
+def _filter_value(value):
+    try:
+        value = int(value)
+    except ValueError:
+        return None
+    return value if MIN_FILTER_VALUE <= value <= MAX_FILTER_VALUE else None
+
+
+# Reads the structured filters from the request args. Values that aren't
+# whole numbers are ignored, like blank ones. Returns {name: value}, with a
+# sorted tuple of values for the list filters, and only the filters that
+# were given
+def read_filters(args):
+    filters = {}
+    for name in LIST_FILTERS:
+        values = sorted({value for value in map(_filter_value, args.getlist(name)) if value is not None})
+        if values:
+            filters[name] = tuple(values)
+    single = [f'{name}_{end}' for name in RANGE_FILTERS for end in ('min', 'max')] + list(MIN_FILTERS)
+    for name in single:
+        value = _filter_value(args.get(name, ''))
+        if value is None:
+            continue
+        if name.startswith('year_') and not MIN_YEAR <= value <= MAX_YEAR:
+            continue
+        filters[name] = value
+    return filters
+
+
+# The filters as request args again, for building links
+def filter_args(filters):
+    return {name: list(value) if isinstance(value, tuple) else value for name, value in filters.items()}
+
+
+# Narrows a query on listing_view to the filters. skip
+# leaves one filter out, which facet counts use for their own dimension
+def apply_filters(query, filters, skip=None):
+    for name, column in LIST_FILTERS.items():
+        if name != skip and name in filters:
+            query = query.filter(column.in_(filters[name]))
+    for name, column in RANGE_FILTERS.items():
+        low, high = filters.get(f'{name}_min'), filters.get(f'{name}_max')
+        # Years are stored as dates, the filter is on whole years
+        if name == 'year':
+            low = date(low, 1, 1) if low is not None else None
+            high = date(high + 1, 1, 1) if high is not None else None
+            if high is not None:
+                query = query.filter(column < high)
+        elif high is not None:
+            query = query.filter(column <= high)
+        if low is not None:
+            query = query.filter(column >= low)
+    for name, column in MIN_FILTERS.items():
+        if name != skip and name in filters:
+            query = query.filter(column >= filters[name])
+    return query
+
+
+# Reads the sort key, direction and page size from the request args,
+# falling back to the defaults for anything missing or invalid
+def read_sort_args(args):
+    searching = search.match_expression(args.get('query')) is not None
+    default = DEFAULT_SEARCH_SORT if searching else DEFAULT_SORT
+    sort = args.get('sort', default)
+    if sort not in SORT_KEYS or (sort == 'relevance' and not searching):
+        sort = default
+    descending = args.get('order', 'asc') == 'desc'
+    try:
+        per_page = int(args.get('per_page', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        per_page = DEFAULT_PAGE_SIZE
+    per_page = max(1, min(per_page, MAX_PAGE_SIZE))
+    return sort, descending, per_page
+
+
+# Cursors are the (sort value, stock_id) of the row at the edge of a page,
+# tagged with the sort they belong to so they can't be replayed on another one
+def encode_cursor(sort, descending, row):
+    value = getattr(row, SORT_KEYS[sort].key)
+    if isinstance(value, date):
+        value = value.isoformat()
+    payload = json.dumps([sort, descending, value, row.stock_id], separators=(',', ':'))
+    return urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(sort, descending, cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        cursor_sort, cursor_descending, value, stock_id = json.loads(urlsafe_b64decode(padded))
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+    if cursor_sort != sort or cursor_descending != descending:
+        raise ValueError('Cursor does not match the requested sort')
+    # The values are bound straight into the page query, so anything a
+    # cursor of this sort couldn't hold is turned away here
+    if stock_id is None or not _cursor_value_fits(stock_id, int) \
+            or not _cursor_value_fits(value, CURSOR_VALUE_TYPES[sort]):
+        raise ValueError('Invalid cursor')
+    if sort == 'year' and value is not None:
+        try:
+            value = date.fromisoformat(value)
+        except ValueError:
+            raise ValueError('Invalid cursor')
+    return value, stock_id
+
+
+# None is the sort value of a car without one (e.g. no price). bool is an
+# int to Python but never a sort value, and SQLite can't take an int
+# outside 64 bits
+def _cursor_value_fits(value, types):
+    if value is None:
+        return True
+    if isinstance(value, bool) or not isinstance(value, types):
+        return False
+    return not isinstance(value, int) or MIN_FILTER_VALUE <= value <= MAX_FILTER_VALUE
+
+
+# Orders the query by the sort key and starts it just past the cursor row.
+# Going backwards reverses the order, so the rows come out last first
+def seek(query, sort, descending, cursor=None, backwards=False):
+    column = SORT_KEYS[sort]
+
+    # Walking forward through a descending sort means moving to smaller keys
+    towards_smaller = descending != backwards
+    if cursor:
+        edge = tuple_(*decode_cursor(sort, descending, cursor))
+        key = tuple_(column, Listing_view.stock_id)
+        query = query.filter(key < edge if towards_smaller else key > edge)
+
+    direction = desc if towards_smaller else asc
+    if column is Listing_view.stock_id:
+        return query.order_by(direction(Listing_view.stock_id))
+    return query.order_by(direction(column), direction(Listing_view.stock_id))
+
+
+# Every car with the same names has the same search rank (see search.py),
+# so a page sorted by relevance nearly always lies within one rank: the
+# cursor's, or on the first page the first rank of the search. Within one
+# rank the order is stock_id alone, which the name index already gives, so
+# SQLite stops reading each name's cars once they're past the page instead
+# of sorting every match. Returns None if the rank runs out before count rows
+def _rows_within_rank(query, rank, descending, cursor, backwards, count):
+    towards_smaller = descending != backwards
+    # Compared as an expression: "rank = ?" on an FTS5 table would set its
+    # ranking function instead
+    query = query.filter(SORT_KEYS['relevance'] + 0 == rank)
+    if cursor:
+        stock_id = decode_cursor('relevance', descending, cursor)[1]
+        query = query.filter(Listing_view.stock_id < stock_id if towards_smaller else Listing_view.stock_id > stock_id)
+    direction = desc if towards_smaller else asc
+    rows = query.order_by(direction(Listing_view.stock_id)).limit(count).all()
+    return rows if len(rows) == count else None
+
+
+# Keyset (seek) pagination: instead of OFFSET, each page starts strictly
+# after (or before) the edge row of the previous one, so the database only
+# ever reads per_page + 1 rows off the sort index no matter how deep we go.
+# Pages sorted by relevance need the search text, for the rank they start at
+def paginate(query, sort, descending, per_page, after=None, before=None, search_text=None):
+    backwards = before is not None
+    cursor = before if backwards else after
+
+    # Fetch one extra row to find out if there is another page
+    rows = None
+    if sort == 'relevance':
+        if cursor:
+            rank = decode_cursor(sort, descending, cursor)[0]
+        else:
+            rank = search.first_rank(query.session, search.match_expression(search_text), descending)
+        if rank is not None:
+            rows = _rows_within_rank(query, rank, descending, cursor, backwards, per_page + 1)
+    if rows is None:
+        rows = seek(query, sort, descending, cursor, backwards).limit(per_page + 1).all()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backwards:
+        rows.reverse()
+
+    # Coming back from a later page means there is always a next one, and
+    # going forward from a cursor means there is always a previous one
+    has_next = True if backwards else has_more
+    has_prev = has_more if backwards else bool(cursor)
+
+    page = Page(rows)
+    if rows:
+        if has_next:
+            page.next_cursor = encode_cursor(sort, descending, rows[-1])
+        if has_prev:
+            page.prev_cursor = encode_cursor(sort, descending, rows[0])
+    return page
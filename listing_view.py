@@ -0,0 +1,48 @@
+from sqlalchemy import bindparam, text
+
+# listing_view rows for a set of stock rows, in the column order of
+# INSERT_LISTING_ROWS
+SELECT_LISTING_ROWS = """
+SELECT car_stock.stock_id,
+       car_stock.manufacturer_id, car_manufacturer.manufacturer_name,
+       car_stock.bodystyle_id, car_bodystyle.bodystyle_name,
+       car_model.model_name, car_model.model_seats, car_model.eco_rating, car_model.safety_rating,
+       car_stock.year, car_stock.car_price, car_stock.distance, car_stock.image_id
+FROM car_stock
+JOIN car_manufacturer ON car_manufacturer.manufacturer_id = car_stock.manufacturer_id
+JOIN car_model ON car_model.model_id = car_stock.model_id
+JOIN car_bodystyle ON car_bodystyle.bodystyle_id = car_stock.bodystyle_id
+"""
+
+INSERT_LISTING_ROWS = (
+    "INSERT INTO listing_view (stock_id, manufacturer_id, manufacturer_name, bodystyle_id, bodystyle_name, "
+    "model_name, model_seats, eco_rating, safety_rating, year, car_price, distance, image_id) "
+)
+
+
+# Rewrites the listing_view rows of the given stock rows (and drops those of
+# stock rows that no longer exist). Runs on the caller's session so the read
+# model changes in the same transaction as the cars
+def refresh_listings(session, stock_ids):
+    stock_ids = list(stock_ids)
+    if not stock_ids:
+        return
+    params = {'stock_ids': stock_ids}
+    session.execute(
+        text("DELETE FROM listing_view WHERE stock_id IN :stock_ids")
+        .bindparams(bindparam('stock_ids', expanding=True)),
+        params,
+    )
+    session.execute(
+        text(INSERT_LISTING_ROWS + SELECT_LISTING_ROWS + "WHERE car_stock.stock_id IN :stock_ids")
+        .bindparams(bindparam('stock_ids', expanding=True)),
+        params,
+    )
+
+
+# Rebuilds the whole read model from the stock tables, e.g. after dimension
+# ids were merged. Returns the number of listings
+def rebuild_listing_view(session):
+    session.execute(text("DELETE FROM listing_view"))
+    session.execute(text(INSERT_LISTING_ROWS + SELECT_LISTING_ROWS))
+    return session.execute(text("SELECT count(*) FROM listing_view")).scalar()
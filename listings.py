@@ -0,0 +1,93 @@
+from models import Car_model, Car_stock, car_images
+from image_store import get_image_store
+from variants import schedule_variants
+from cache import bump_inventory_version
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+import analytics
+import dimensions
+import facets
+import listing_view
+import search
+
+
+# Adds one car listing (model, image and stock row) to the session. The car
+# is a dict with the keys bulk_import.parse_row produces, plus optional
+# image_hash, image_mimetype and image_car. Nothing is committed: the caller
+# commits once with commit_listings, so a listing costs one transaction
+def create_listing(session, car):
+    return create_listings(session, [car])[0]
+
+
+def create_listings(session, cars):
+    manufacturer_ids = dimensions.manufacturers.get_or_create_many(session, [car['manufacturer'] for car in cars])
+    bodystyle_ids = dimensions.bodystyles.get_or_create_many(session, [car['bodystyle'] for car in cars])
+
+    stocks = []
+    for car in cars:
+        model = Car_model(
+            model_name=car['model'],
+            model_horsepower=car['horsepower'],
+            model_torque=car['torque'],
+            eco_rating=car['eco_rating'],
+            safety_rating=car['safety_rating'],
+            model_seats=car['seats']
+        )
+        image = None
+        if car.get('image_hash'):
+            image = car_images(
+                image_hash=car['image_hash'],
+                image_mimetype=car.get('image_mimetype'),
+                image_car=car.get('image_car')
+            )
+        stock = Car_stock(
+            manufacturer_id=manufacturer_ids[car['manufacturer']],
+            bodystyle_id=bodystyle_ids[car['bodystyle']],
+            model=model,
+            year=car['year'],
+            car_price=car['price'],
+            distance=car['distance'],
+            image=image
+        )
+        session.add(stock)
+        stocks.append(stock)
+
+    # Flush to get the stock ids for the search index
+    session.flush()
+    listings_written(session, [stock.stock_id for stock in stocks],
+                     [car.get('image_hash') for car in cars])
+    return stocks
+
+
+# Keeps everything derived from the stock tables in step with new listings.
+# Tables are updated in the current transaction; work that should only
+# happen once the listings are committed is queued for commit_listings
+def listings_written(session, stock_ids, image_hashes=()):
+    search.index_stocks(session, stock_ids)
+    # The rollups are moved from the old listing_view rows to the new ones
+    analytics.remove_listings(session, stock_ids)
+    listing_view.refresh_listings(session, stock_ids)
+    analytics.add_listings(session, stock_ids)
+    written = session.info.setdefault('written_listings', {'stock_ids': [], 'image_hashes': []})
+    written['stock_ids'].extend(stock_ids)
+    written['image_hashes'].extend(image_hash for image_hash in image_hashes if image_hash)
+
+
+# Commits the listings added to the session and starts their follow-up work
+def commit_listings(session):
+    written = session.info.pop('written_listings', {'stock_ids': [], 'image_hashes': []})
+    session.commit()
+    facets.invalidate()
+    # Cached pages and facet counts in every worker go stale
+    bump_inventory_version()
+
+    # Resized copies for the inventory page are built in the background
+    image_store = get_image_store()
+    for image_hash in set(written['image_hashes']):
+        schedule_variants(image_store, image_hash)
+
+
+# Listings from a rolled back transaction were never saved
+@event.listens_for(Session, 'after_rollback')
+def discard_written(session):
+    session.info.pop('written_listings', None)
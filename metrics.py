@@ -0,0 +1,280 @@
+from flask import before_render_template, g, has_request_context, request, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from cache import page_cache
+from weakref import WeakKeyDictionary
+import facets
+import logging
+import sqlite3
+import threading
+import time
+
+slow_query_logger = logging.getLogger('metrics.slow_query')
+
+# Upper bounds, in seconds, of the request duration histogram buckets
+DURATION_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+# Longest bound parameter list written to the slow query log
+SLOW_QUERY_PARAMS_LENGTH = 500
+
+
+# Totals per route since this process started. Each gunicorn worker keeps
+# its own, which Prometheus adds up across the scrape targets
+class RequestMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = {}
+        self.routes = {}
+        self.slow_queries = 0
+        self.startup_seconds = {}
+
+    def observe(self, endpoint, method, status, duration, queries, sql_time, render_time, size):
+        with self._lock:
+            key = (endpoint, method, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            route = self.routes.get(endpoint)
+            if route is None:
+                route = self.routes[endpoint] = {
+                    'buckets': [0] * len(DURATION_BUCKETS), 'count': 0, 'duration': 0.0,
+                    'queries': 0, 'sql_time': 0.0, 'render_time': 0.0, 'bytes': 0,
+                }
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if duration <= bound:
+                    route['buckets'][i] += 1
+            route['count'] += 1
+            route['duration'] += duration
+            route['queries'] += queries
+            route['sql_time'] += sql_time
+            route['render_time'] += render_time
+            route['bytes'] += size
+
+    def slow_query(self):
+        with self._lock:
+            self.slow_queries += 1
+
+    # How long a phase of starting up took (create_app, warm_up, and for
+    # gunicorn workers worker_spawn)
+    def startup(self, phase, seconds):
+        with self._lock:
+            self.startup_seconds[phase] = seconds
+
+    # The Prometheus text exposition format
+    def render(self):
+        with self._lock:
+            requests = sorted(self.requests.items())
+            routes = sorted((endpoint, dict(route, buckets=list(route['buckets'])))
+                            for endpoint, route in self.routes.items())
+            slow_queries = self.slow_queries
+            startup = sorted(self.startup_seconds.items())
+
+        lines = [
+            '# HELP http_requests_total Requests handled, by route, method and status.',
+            '# TYPE http_requests_total counter',
+        ]
+        for (endpoint, method, status), count in requests:
+            lines.append(f'http_requests_total{{endpoint="{endpoint}",method="{method}",status="{status}"}} {count}')
+
+        lines += [
+            '# HELP http_request_duration_seconds Time from the start of a request to its response.',
+            '# TYPE http_request_duration_seconds histogram',
+        ]
+        for endpoint, route in routes:
+            for bound, count in zip(DURATION_BUCKETS, route['buckets']):
+                lines.append(f'http_request_duration_seconds_bucket{{endpoint="{endpoint}",le="{bound}"}} {count}')
+            lines.append(f'http_request_duration_seconds_bucket{{endpoint="{endpoint}",le="+Inf"}} {route["count"]}')
+            lines.append(f'http_request_duration_seconds_sum{{endpoint="{endpoint}"}} {route["duration"]:.6f}')
+            lines.append(f'http_request_duration_seconds_count{{endpoint="{endpoint}"}} {route["count"]}')
+
+        for name, key, kind, help_text in [
+            ('sql_queries_total', 'queries', 'counter', 'SQL statements run while handling requests.'),
+            ('sql_duration_seconds_total', 'sql_time', 'counter', 'Time spent running SQL statements and fetching their rows.'),
+            ('template_render_seconds_total', 'render_time', 'counter', 'Time spent rendering templates.'),
+            ('http_response_bytes_total', 'bytes', 'counter', 'Size of the response bodies, where known up front.'),
+        ]:
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+            for endpoint, route in routes:
+                value = route[key]
+                lines.append(f'{name}{{endpoint="{endpoint}"}} {value:.6f}' if isinstance(value, float)
+                             else f'{name}{{endpoint="{endpoint}"}} {value}')
+
+        lines += [
+            '# HELP sql_slow_queries_total Statements slower than SLOW_QUERY_SECONDS.',
+            '# TYPE sql_slow_queries_total counter',
+            f'sql_slow_queries_total {slow_queries}',
+        ]
+
+        lines += ['# HELP app_startup_seconds Time taken by each phase of starting this process.',
+                  '# TYPE app_startup_seconds gauge']
+        for phase, seconds in startup:
+            lines.append(f'app_startup_seconds{{phase="{phase}"}} {seconds:.6f}')
+
+        caches = [('pages', page_cache), ('facets', facets.facet_cache)]
+        for name, attribute, kind, help_text in [
+            ('cache_hits_total', 'hits', 'counter', 'Lookups answered from an in-process cache.'),
+            ('cache_misses_total', 'misses', 'counter', 'Lookups an in-process cache could not answer.'),
+        ]:
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+            for cache_name, cache in caches:
+                lines.append(f'{name}{{cache="{cache_name}"}} {getattr(cache, attribute)}')
+        lines += ['# HELP cache_entries Entries held in an in-process cache.', '# TYPE cache_entries gauge']
+        for cache_name, cache in caches:
+            lines.append(f'cache_entries{{cache="{cache_name}"}} {len(cache)}')
+        return '\n'.join(lines) + '\n'
+
+
+request_metrics = RequestMetrics()
+# SLOW_QUERY_SECONDS of each app's engine
+_slow_query_seconds = WeakKeyDictionary()
+
+
+# The counters of the request being handled, or None outside a request or
+# with metrics turned off
+def _current():
+    return g.get('metrics') if has_request_context() else None
+
+
+def _log_if_slow(threshold, statement, parameters, elapsed):
+    if elapsed < threshold:
+        return
+    request_metrics.slow_query()
+    params = repr(parameters)
+    if len(params) > SLOW_QUERY_PARAMS_LENGTH:
+        params = params[:SLOW_QUERY_PARAMS_LENGTH] + '...'
+    slow_query_logger.warning("Slow query (%.1f ms): %s -- parameters: %s", elapsed * 1000, statement, params)
+
+
+# SQLite does most of the work of a query while its rows are fetched, not
+# in execute(). This cursor adds the time spent in each fetch to the
+# request's SQL time, and checks a statement against the slow query
+# threshold once SQLAlchemy closes its cursor, with the execute and fetch
+# time added up
+class TimedCursor(sqlite3.Cursor):
+    # [threshold, statement, parameters, seconds so far] of the statement
+    # being read, when it is checked for the slow query log
+    statement = None
+
+    def _timed(self, fetch, *args):
+        started = time.perf_counter()
+        try:
+            return fetch(*args)
+        finally:
+            elapsed = time.perf_counter() - started
+            current = _current()
+            if current is not None:
+                current['sql_time'] += elapsed
+            if self.statement is not None:
+                self.statement[3] += elapsed
+
+    def fetchone(self):
+        return self._timed(super().fetchone)
+
+    def fetchmany(self, *args):
+        return self._timed(super().fetchmany, *args)
+
+    def fetchall(self):
+        return self._timed(super().fetchall)
+
+    def __next__(self):
+        return self._timed(super().__next__)
+
+    def close(self):
+        statement, self.statement = self.statement, None
+        if statement is not None:
+            _log_if_slow(*statement)
+        super().close()
+
+
+class TimedConnection(sqlite3.Connection):
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+
+# Every SQLite connection is opened as a TimedConnection, so its cursors
+# time their fetches
+@event.listens_for(Engine, 'do_connect')
+def _timed_connection(dialect, conn_rec, cargs, cparams):
+    if dialect.name == 'sqlite' and dialect.driver == 'pysqlite':
+        cparams.setdefault('factory', TimedConnection)
+
+
+# Times every statement on every engine. Statements run outside a request
+# (CLI commands, background jobs) only go to the slow query log
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_started'].pop()
+    current = _current()
+    if current is not None:
+        current['queries'] += 1
+        current['sql_time'] += elapsed
+    threshold = _slow_query_seconds.get(conn.engine)
+    if threshold is None:
+        return
+    if isinstance(cursor, TimedCursor):
+        # Checked once the rows are read, see TimedCursor.close
+        cursor.statement = [threshold, statement, parameters, elapsed]
+    else:
+        _log_if_slow(threshold, statement, parameters, elapsed)
+
+
+# Records the query count, SQL time, template render time, response size and
+# total time of each request. Set METRICS to False to turn it all off,
+# SLOW_QUERY_SECONDS to log statements slower than that, and SERVER_TIMING
+# to add a Server-Timing header browsers show in their network panel (on by
+# default in debug mode)
+def register_metrics(app, db):
+    app.config.setdefault('METRICS', True)
+    app.config.setdefault('SLOW_QUERY_SECONDS', None)
+    app.config.setdefault('SERVER_TIMING', app.debug)
+    if not app.config['METRICS']:
+        return
+
+    # The events above listen on every Engine; this picks which engines'
+    # statements are checked against the threshold. GET requests run on the
+    # read-only engine (see database.py), so it is checked as well
+    if app.config['SLOW_QUERY_SECONDS'] is not None:
+        with app.app_context():
+            engines = [db.engine, app.extensions.get('read_only_engine')]
+        for engine in engines:
+            if engine is not None:
+                _slow_query_seconds[engine] = float(app.config['SLOW_QUERY_SECONDS'])
+
+    @app.before_request
+    def start_request_metrics():
+        g.metrics = {'started': time.perf_counter(), 'queries': 0, 'sql_time': 0.0, 'render_time': 0.0}
+
+    def template_started(sender, template, context, **extra):
+        current = _current()
+        if current is not None:
+            current['render_started'] = time.perf_counter()
+
+    def template_finished(sender, template, context, **extra):
+        current = _current()
+        if current is not None and 'render_started' in current:
+            current['render_time'] += time.perf_counter() - current.pop('render_started')
+
+    before_render_template.connect(template_started, app, weak=False)
+    template_rendered.connect(template_finished, app, weak=False)
+
+    # Streamed responses (e.g. /api/cars) are counted up to their first
+    # byte; their size isn't known yet, so it isn't added
+    @app.after_request
+    def record_request_metrics(response):
+        current = _current()
+        if current is None:
+            return response
+        duration = time.perf_counter() - current['started']
+        request_metrics.observe(
+            request.endpoint or 'unknown', request.method, response.status_code, duration,
+            current['queries'], current['sql_time'], current['render_time'], response.content_length or 0,
+        )
+        if app.config['SERVER_TIMING']:
+            response.headers['Server-Timing'] = (
+                f'sql;dur={current["sql_time"] * 1000:.1f};desc="{current["queries"]} queries", '
+                f'render;dur={current["render_time"] * 1000:.1f}, '
+                f'total;dur={duration * 1000:.1f}'
+            )
+        return response
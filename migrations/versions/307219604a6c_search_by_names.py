@@ -0,0 +1,50 @@
+"""search index by names
+
+Revision ID: 307219604a6c
+Revises: 3c9e71b04a68
+Create Date: 2026-10-18 21:40:37.518204
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '307219604a6c'
+down_revision = '3c9e71b04a68'
+branch_labels = None
+depends_on = None
+
+NAME_JOINS = (
+    "FROM car_stock "
+    "JOIN car_manufacturer ON car_manufacturer.manufacturer_id = car_stock.manufacturer_id "
+    "JOIN car_model ON car_model.model_id = car_stock.model_id "
+    "JOIN car_bodystyle ON car_bodystyle.bodystyle_id = car_stock.bodystyle_id"
+)
+
+
+# The search index goes from one entry per car to one per distinct set of
+# names, and listing_view gets an index to find the cars of a set of names
+def upgrade():
+    op.execute("DELETE FROM car_search")
+    op.execute(
+        "INSERT INTO car_search(manufacturer_name, model_name, bodystyle_name) "
+        "SELECT DISTINCT car_manufacturer.manufacturer_name, car_model.model_name, "
+        f"car_bodystyle.bodystyle_name {NAME_JOINS}"
+    )
+    # The deleted entries stay in the index until its segments are merged
+    op.execute("INSERT INTO car_search(car_search) VALUES('optimize')")
+    with op.batch_alter_table('listing_view') as batch_op:
+        batch_op.create_index('ix_listing_view_names', ['manufacturer_name', 'model_name', 'bodystyle_name'])
+    op.execute("ANALYZE")
+
+
+def downgrade():
+    with op.batch_alter_table('listing_view') as batch_op:
+        batch_op.drop_index('ix_listing_view_names')
+    op.execute("DELETE FROM car_search")
+    op.execute(
+        "INSERT INTO car_search(rowid, manufacturer_name, model_name, bodystyle_name) "
+        "SELECT car_stock.stock_id, car_manufacturer.manufacturer_name, car_model.model_name, "
+        f"car_bodystyle.bodystyle_name {NAME_JOINS}"
+    )
+    op.execute("INSERT INTO car_search(car_search) VALUES('optimize')")
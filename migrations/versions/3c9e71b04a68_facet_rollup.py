@@ -0,0 +1,57 @@
+"""facet rollup and listing_view filter indexes
+
+Revision ID: 3c9e71b04a68
+Revises: e5a0c3f19d27
+Create Date: 2026-10-18 18:05:12.730941
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c9e71b04a68'
+down_revision = 'e5a0c3f19d27'
+branch_labels = None
+depends_on = None
+
+# Group key of each facet, as in analytics.FACET_DIMENSIONS
+FACET_DIMENSIONS = {
+    'manufacturer': "manufacturer_id",
+    'bodystyle': "bodystyle_id",
+    'seats': "model_seats",
+    'eco_rating': "eco_rating",
+    'safety_rating': "safety_rating",
+}
+
+
+# Listings per facet value, filled from the existing stock, and indexes for
+# the filters facets are counted under
+def upgrade():
+    op.create_table(
+        'facet_rollup',
+        sa.Column('dimension', sa.String(length=20), nullable=False),
+        sa.Column('group_key', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('listing_count', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('dimension', 'group_key')
+    )
+    for dimension, key in FACET_DIMENSIONS.items():
+        op.execute(
+            "INSERT INTO facet_rollup (dimension, group_key, listing_count) "
+            f"SELECT '{dimension}', {key}, count(*) "
+            "FROM car_stock JOIN car_model ON car_model.model_id = car_stock.model_id "
+            f"WHERE {key} IS NOT NULL GROUP BY 2"
+        )
+    with op.batch_alter_table('listing_view') as batch_op:
+        batch_op.create_index('ix_listing_view_model_seats', ['model_seats'])
+        batch_op.create_index('ix_listing_view_eco_rating', ['eco_rating'])
+        batch_op.create_index('ix_listing_view_safety_rating', ['safety_rating'])
+    op.execute("ANALYZE")
+
+
+def downgrade():
+    with op.batch_alter_table('listing_view') as batch_op:
+        batch_op.drop_index('ix_listing_view_safety_rating')
+        batch_op.drop_index('ix_listing_view_eco_rating')
+        batch_op.drop_index('ix_listing_view_model_seats')
+    op.drop_table('facet_rollup')
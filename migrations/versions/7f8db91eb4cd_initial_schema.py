@@ -0,0 +1,75 @@
+"""initial schema
+
+Revision ID: 7f8db91eb4cd
+Revises: 
+Create Date: 2026-10-18 12:17:10.324936
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7f8db91eb4cd'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+# The schema the app had before migrations were added. Databases created by
+# db.create_all() back then are stamped at this revision rather than rebuilt
+def upgrade():
+    op.create_table(
+        'car_bodystyle',
+        sa.Column('bodystyle_id', sa.Integer(), nullable=False),
+        sa.Column('bodystyle_name', sa.String(length=50), nullable=False),
+        sa.PrimaryKeyConstraint('bodystyle_id')
+    )
+    op.create_table(
+        'car_manufacturer',
+        sa.Column('manufacturer_id', sa.Integer(), nullable=False),
+        sa.Column('manufacturer_name', sa.String(length=100), nullable=False),
+        sa.PrimaryKeyConstraint('manufacturer_id')
+    )
+    op.create_table(
+        'car_model',
+        sa.Column('model_id', sa.Integer(), nullable=False),
+        sa.Column('model_name', sa.String(length=100), nullable=False),
+        sa.Column('model_horsepower', sa.Integer(), nullable=True),
+        sa.Column('model_torque', sa.Integer(), nullable=True),
+        sa.Column('eco_rating', sa.Integer(), nullable=True),
+        sa.Column('safety_rating', sa.Integer(), nullable=True),
+        sa.Column('model_seats', sa.Integer(), nullable=True),
+        sa.PrimaryKeyConstraint('model_id')
+    )
+    op.create_table(
+        'car_images',
+        sa.Column('image_id', sa.Integer(), nullable=False),
+        sa.Column('image', sa.String(), nullable=True),
+        sa.Column('image_car', sa.String(length=100), nullable=True),
+        sa.PrimaryKeyConstraint('image_id')
+    )
+    op.create_table(
+        'car_stock',
+        sa.Column('stock_id', sa.Integer(), nullable=False),
+        sa.Column('manufacturer_id', sa.Integer(), nullable=False),
+        sa.Column('bodystyle_id', sa.Integer(), nullable=False),
+        sa.Column('model_id', sa.Integer(), nullable=False),
+        sa.Column('year', sa.Date(), nullable=True),
+        sa.Column('car_price', sa.Integer(), nullable=True),
+        sa.Column('distance', sa.Integer(), nullable=True),
+        sa.Column('image_id', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['bodystyle_id'], ['car_bodystyle.bodystyle_id']),
+        sa.ForeignKeyConstraint(['image_id'], ['car_images.image_id']),
+        sa.ForeignKeyConstraint(['manufacturer_id'], ['car_manufacturer.manufacturer_id']),
+        sa.ForeignKeyConstraint(['model_id'], ['car_model.model_id']),
+        sa.PrimaryKeyConstraint('stock_id')
+    )
+
+
+def downgrade():
+    op.drop_table('car_stock')
+    op.drop_table('car_images')
+    op.drop_table('car_model')
+    op.drop_table('car_manufacturer')
+    op.drop_table('car_bodystyle')
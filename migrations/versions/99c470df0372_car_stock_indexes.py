@@ -0,0 +1,44 @@
+"""car_stock indexes
+
+Revision ID: 99c470df0372
+Revises: d241ae210b66
+Create Date: 2026-10-18 12:17:10.343215
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '99c470df0372'
+down_revision = 'd241ae210b66'
+branch_labels = None
+depends_on = None
+
+
+# Indexes for the foreign keys and the columns the inventory page sorts and
+# filters on. ANALYZE afterwards gives the query planner row counts to use
+def upgrade():
+    with op.batch_alter_table('car_stock') as batch_op:
+        batch_op.create_index('ix_car_stock_car_price', ['car_price'])
+        batch_op.create_index('ix_car_stock_year', ['year'])
+        batch_op.create_index('ix_car_stock_distance', ['distance'])
+        batch_op.create_index('ix_car_stock_manufacturer_price', ['manufacturer_id', 'car_price'])
+        batch_op.create_index('ix_car_stock_bodystyle_price', ['bodystyle_id', 'car_price'])
+        batch_op.create_index('ix_car_stock_model_id', ['model_id'])
+        batch_op.create_index('ix_car_stock_image_id', ['image_id'])
+    with op.batch_alter_table('car_images') as batch_op:
+        batch_op.create_index('ix_car_images_image_hash', ['image_hash'])
+    op.execute("ANALYZE")
+
+
+def downgrade():
+    with op.batch_alter_table('car_images') as batch_op:
+        batch_op.drop_index('ix_car_images_image_hash')
+    with op.batch_alter_table('car_stock') as batch_op:
+        batch_op.drop_index('ix_car_stock_image_id')
+        batch_op.drop_index('ix_car_stock_model_id')
+        batch_op.drop_index('ix_car_stock_bodystyle_price')
+        batch_op.drop_index('ix_car_stock_manufacturer_price')
+        batch_op.drop_index('ix_car_stock_distance')
+        batch_op.drop_index('ix_car_stock_year')
+        batch_op.drop_index('ix_car_stock_car_price')
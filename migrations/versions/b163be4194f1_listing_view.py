@@ -0,0 +1,64 @@
+"""listing view
+
+Revision ID: b163be4194f1
+Revises: 99c470df0372
+Create Date: 2026-10-18 13:08:08.209762
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b163be4194f1'
+down_revision = '99c470df0372'
+branch_labels = None
+depends_on = None
+
+
+# The denormalized copy of the listings the inventory page reads, filled
+# from the existing stock
+def upgrade():
+    op.create_table(
+        'listing_view',
+        sa.Column('stock_id', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('manufacturer_id', sa.Integer(), nullable=False),
+        sa.Column('manufacturer_name', sa.String(length=100), nullable=False),
+        sa.Column('bodystyle_id', sa.Integer(), nullable=False),
+        sa.Column('bodystyle_name', sa.String(length=50), nullable=False),
+        sa.Column('model_name', sa.String(length=100), nullable=False),
+        sa.Column('model_seats', sa.Integer(), nullable=True),
+        sa.Column('eco_rating', sa.Integer(), nullable=True),
+        sa.Column('safety_rating', sa.Integer(), nullable=True),
+        sa.Column('year', sa.Date(), nullable=True),
+        sa.Column('car_price', sa.Integer(), nullable=True),
+        sa.Column('distance', sa.Integer(), nullable=True),
+        sa.Column('image_id', sa.Integer(), nullable=True),
+        sa.PrimaryKeyConstraint('stock_id')
+    )
+    op.execute(
+        "INSERT INTO listing_view (stock_id, manufacturer_id, manufacturer_name, bodystyle_id, bodystyle_name, "
+        "model_name, model_seats, eco_rating, safety_rating, year, car_price, distance, image_id) "
+        "SELECT car_stock.stock_id, "
+        "car_stock.manufacturer_id, car_manufacturer.manufacturer_name, "
+        "car_stock.bodystyle_id, car_bodystyle.bodystyle_name, "
+        "car_model.model_name, car_model.model_seats, car_model.eco_rating, car_model.safety_rating, "
+        "car_stock.year, car_stock.car_price, car_stock.distance, car_stock.image_id "
+        "FROM car_stock "
+        "JOIN car_manufacturer ON car_manufacturer.manufacturer_id = car_stock.manufacturer_id "
+        "JOIN car_model ON car_model.model_id = car_stock.model_id "
+        "JOIN car_bodystyle ON car_bodystyle.bodystyle_id = car_stock.bodystyle_id"
+    )
+    # Indexes after the rows are in, which is quicker than keeping them up
+    # to date row by row
+    with op.batch_alter_table('listing_view') as batch_op:
+        batch_op.create_index('ix_listing_view_car_price', ['car_price'])
+        batch_op.create_index('ix_listing_view_year', ['year'])
+        batch_op.create_index('ix_listing_view_distance', ['distance'])
+        batch_op.create_index('ix_listing_view_manufacturer_price', ['manufacturer_id', 'car_price'])
+        batch_op.create_index('ix_listing_view_bodystyle_price', ['bodystyle_id', 'car_price'])
+    op.execute("ANALYZE")
+
+
+def downgrade():
+    op.drop_table('listing_view')
@@ -0,0 +1,78 @@
+"""image store, unique names and search index
+
+Revision ID: d241ae210b66
+Revises: 7f8db91eb4cd
+Create Date: 2026-10-18 12:17:10.335204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd241ae210b66'
+down_revision = '7f8db91eb4cd'
+branch_labels = None
+depends_on = None
+
+
+# (table, id column, name column, unique index) of each dimension table
+DIMENSIONS = [
+    ('car_manufacturer', 'manufacturer_id', 'manufacturer_name', 'uq_manufacturer_name'),
+    ('car_bodystyle', 'bodystyle_id', 'bodystyle_name', 'uq_bodystyle_name'),
+]
+
+
+def upgrade():
+    connection = op.get_bind()
+
+    # Image store columns. Databases that ran 'flask migrate-images' before
+    # there were migrations already have them, so only add the missing ones
+    columns = [column['name'] for column in sa.inspect(connection).get_columns('car_images')]
+    with op.batch_alter_table('car_images') as batch_op:
+        if 'image_hash' not in columns:
+            batch_op.add_column(sa.Column('image_hash', sa.String(length=64), nullable=True))
+        if 'image_mimetype' not in columns:
+            batch_op.add_column(sa.Column('image_mimetype', sa.String(length=50), nullable=True))
+
+    # Merge duplicate names onto the lowest id before making names unique
+    for table, id_column, name_column, index_name in DIMENSIONS:
+        duplicates = (
+            f"SELECT {id_column} FROM {table} WHERE {id_column} NOT IN "
+            f"(SELECT min({id_column}) FROM {table} GROUP BY {name_column})"
+        )
+        op.execute(
+            f"UPDATE car_stock SET {id_column} = ("
+            f"SELECT min(keep.{id_column}) FROM {table} AS keep "
+            f"JOIN {table} AS dup ON dup.{name_column} = keep.{name_column} "
+            f"WHERE dup.{id_column} = car_stock.{id_column}) "
+            f"WHERE {id_column} IN ({duplicates})"
+        )
+        op.execute(f"DELETE FROM {table} WHERE {id_column} IN ({duplicates})")
+        op.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {index_name} ON {table} ({name_column})")
+
+    # Full-text search index, filled from the existing stock
+    op.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS car_search USING fts5("
+        "manufacturer_name, model_name, bodystyle_name, "
+        "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+    )
+    op.execute("DELETE FROM car_search")
+    op.execute(
+        "INSERT INTO car_search(rowid, manufacturer_name, model_name, bodystyle_name) "
+        "SELECT car_stock.stock_id, car_manufacturer.manufacturer_name, "
+        "car_model.model_name, car_bodystyle.bodystyle_name "
+        "FROM car_stock "
+        "JOIN car_manufacturer ON car_manufacturer.manufacturer_id = car_stock.manufacturer_id "
+        "JOIN car_model ON car_model.model_id = car_stock.model_id "
+        "JOIN car_bodystyle ON car_bodystyle.bodystyle_id = car_stock.bodystyle_id"
+    )
+
+
+def downgrade():
+    op.execute("DROP TABLE IF EXISTS car_search")
+    for table, id_column, name_column, index_name in DIMENSIONS:
+        op.drop_index(index_name, table_name=table)
+    with op.batch_alter_table('car_images') as batch_op:
+        batch_op.drop_column('image_mimetype')
+        batch_op.drop_column('image_hash')
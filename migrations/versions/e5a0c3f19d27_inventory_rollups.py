@@ -0,0 +1,80 @@
+"""inventory rollups
+
+Revision ID: e5a0c3f19d27
+Revises: b163be4194f1
+Create Date: 2026-10-18 16:42:31.518204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5a0c3f19d27'
+down_revision = 'b163be4194f1'
+branch_labels = None
+depends_on = None
+
+# Group key of each rollup dimension, as in analytics.DIMENSIONS
+DIMENSIONS = {
+    'all': "0",
+    'manufacturer': "manufacturer_id",
+    'bodystyle': "bodystyle_id",
+    'year': "coalesce(CAST(strftime('%Y', year) AS INTEGER), 0)",
+}
+
+
+# The analytics rollups, filled from the existing stock
+def upgrade():
+    op.create_table(
+        'inventory_rollup',
+        sa.Column('dimension', sa.String(length=20), nullable=False),
+        sa.Column('group_key', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('listing_count', sa.Integer(), nullable=False),
+        sa.Column('price_count', sa.Integer(), nullable=False),
+        sa.Column('price_sum', sa.Integer(), nullable=False),
+        sa.Column('distance_count', sa.Integer(), nullable=False),
+        sa.Column('distance_sum', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('dimension', 'group_key')
+    )
+    op.create_table(
+        'price_bucket_rollup',
+        sa.Column('dimension', sa.String(length=20), nullable=False),
+        sa.Column('group_key', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('price_bucket', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('listing_count', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('dimension', 'group_key', 'price_bucket')
+    )
+    op.create_table(
+        'price_rollup',
+        sa.Column('dimension', sa.String(length=20), nullable=False),
+        sa.Column('group_key', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('price_bucket', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('car_price', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('listing_count', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('dimension', 'group_key', 'price_bucket', 'car_price')
+    )
+    for dimension, key in DIMENSIONS.items():
+        op.execute(
+            "INSERT INTO inventory_rollup (dimension, group_key, listing_count, price_count, price_sum, "
+            "distance_count, distance_sum) "
+            f"SELECT '{dimension}', {key}, count(*), count(car_price), coalesce(sum(car_price), 0), "
+            "count(distance), coalesce(sum(distance), 0) "
+            "FROM car_stock GROUP BY 2"
+        )
+        op.execute(
+            "INSERT INTO price_bucket_rollup (dimension, group_key, price_bucket, listing_count) "
+            f"SELECT '{dimension}', {key}, car_price / 1000, count(*) "
+            "FROM car_stock WHERE car_price IS NOT NULL GROUP BY 2, 3"
+        )
+        op.execute(
+            "INSERT INTO price_rollup (dimension, group_key, price_bucket, car_price, listing_count) "
+            f"SELECT '{dimension}', {key}, car_price / 1000, car_price, count(*) "
+            "FROM car_stock WHERE car_price IS NOT NULL GROUP BY 2, 3, 4"
+        )
+
+
+def downgrade():
+    op.drop_table('price_rollup')
+    op.drop_table('price_bucket_rollup')
+    op.drop_table('inventory_rollup')
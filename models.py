@@ -1,14 +1,19 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
+from database import RoutingSession
 
 
-# Initialize the database
-db = SQLAlchemy()
+# Initialize the database. Read-only requests are routed to a separate
+# read-only engine, see database.py
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 
 # Bodystyle table
 class Car_bodystyle(db.Model):
     __tablename__ = 'car_bodystyle'
+    __table_args__ = (
+        db.Index('uq_bodystyle_name', 'bodystyle_name', unique=True),
+    )
     bodystyle_id = db.Column(db.Integer, primary_key=True)
     bodystyle_name = db.Column(db.String(50), nullable=False)
 
@@ -18,6 +23,9 @@ class Car_bodystyle(db.Model):
 # Manufacturer table
 class Car_manufacturer(db.Model):
     __tablename__ = 'car_manufacturer'
+    __table_args__ = (
+        db.Index('uq_manufacturer_name', 'manufacturer_name', unique=True),
+    )
     manufacturer_id = db.Column(db.Integer, primary_key=True)
     manufacturer_name = db.Column(db.String(100), nullable=False)
 
@@ -42,8 +50,14 @@ class Car_model(db.Model):
 class car_images(db.Model):
     __tablename__ = 'car_images'
     image_id = db.Column(db.Integer, primary_key=True)
-    image = db.Column(db.String)  
+    # Legacy image bytes, only set on rows not yet moved into the image store.
+    # Deferred so loading an image row never pulls the blob by accident
+    image = db.deferred(db.Column(db.String))
     image_car = db.Column(db.String(100))
+    # SHA-256 of the image file in the image store
+    image_hash = db.Column(db.String(64), index=True)
+    # Content type sniffed from the image bytes when it was stored
+    image_mimetype = db.Column(db.String(50))
 
     def __repr__(self):
         return f'<car_images {self.image_id}>'
@@ -51,14 +65,25 @@ class car_images(db.Model):
 # Stock table
 class Car_stock(db.Model):
     __tablename__ = 'car_stock'
+    # SQLite ends every index entry with the rowid (stock_id), so the sort
+    # indexes already give the (key, stock_id) order keyset pagination seeks on
+    __table_args__ = (
+        db.Index('ix_car_stock_car_price', 'car_price'),
+        db.Index('ix_car_stock_year', 'year'),
+        db.Index('ix_car_stock_distance', 'distance'),
+        # Cars of one make or bodystyle, cheapest first. These also serve
+        # as the indexes for the manufacturer and bodystyle foreign keys
+        db.Index('ix_car_stock_manufacturer_price', 'manufacturer_id', 'car_price'),
+        db.Index('ix_car_stock_bodystyle_price', 'bodystyle_id', 'car_price'),
+    )
     stock_id = db.Column(db.Integer, primary_key=True)
     manufacturer_id = db.Column(db.Integer, db.ForeignKey('car_manufacturer.manufacturer_id'), nullable=False)
     bodystyle_id = db.Column(db.Integer, db.ForeignKey('car_bodystyle.bodystyle_id'), nullable=False)
-    model_id = db.Column(db.Integer, db.ForeignKey('car_model.model_id'), nullable=False)
+    model_id = db.Column(db.Integer, db.ForeignKey('car_model.model_id'), nullable=False, index=True)
     year = db.Column(db.Date)
     car_price = db.Column(db.Integer)
     distance = db.Column(db.Integer)
-    image_id = db.Column(db.Integer, db.ForeignKey('car_images.image_id'))
+    image_id = db.Column(db.Integer, db.ForeignKey('car_images.image_id'), index=True)
     
     # Relationships
     manufacturer = db.relationship('Car_manufacturer', backref='stock_entries')
@@ -68,4 +93,98 @@ class Car_stock(db.Model):
 
 # Returning all objects in the database
     def __repr__(self):
-        return f'<Car_stock {self.stock_id}>'
\ No newline at end of file
+        return f'<Car_stock {self.stock_id}>'
+
+
+# Flat copy of each listing with the names it is shown and filtered by
+# already joined in. The inventory page, its facets and the feed read this
+# instead of joining car_stock to four tables. Kept in step with the stock
+# tables by listing_view.refresh_listings, in the same transaction
+class Listing_view(db.Model):
+    __tablename__ = 'listing_view'
+    # The same sort and filter indexes as car_stock
+    __table_args__ = (
+        db.Index('ix_listing_view_car_price', 'car_price'),
+        db.Index('ix_listing_view_year', 'year'),
+        db.Index('ix_listing_view_distance', 'distance'),
+        db.Index('ix_listing_view_manufacturer_price', 'manufacturer_id', 'car_price'),
+        db.Index('ix_listing_view_bodystyle_price', 'bodystyle_id', 'car_price'),
+        # The seat and rating filters, so a narrow one is found without
+        # scanning every listing
+        db.Index('ix_listing_view_model_seats', 'model_seats'),
+        db.Index('ix_listing_view_eco_rating', 'eco_rating'),
+        db.Index('ix_listing_view_safety_rating', 'safety_rating'),
+        # Finds the cars of the names a search matched (see search.py)
+        db.Index('ix_listing_view_names', 'manufacturer_name', 'model_name', 'bodystyle_name'),
+    )
+    stock_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    manufacturer_id = db.Column(db.Integer, nullable=False)
+    manufacturer_name = db.Column(db.String(100), nullable=False)
+    bodystyle_id = db.Column(db.Integer, nullable=False)
+    bodystyle_name = db.Column(db.String(50), nullable=False)
+    model_name = db.Column(db.String(100), nullable=False)
+    model_seats = db.Column(db.Integer)
+    eco_rating = db.Column(db.Integer)
+    safety_rating = db.Column(db.Integer)
+    year = db.Column(db.Date)
+    car_price = db.Column(db.Integer)
+    distance = db.Column(db.Integer)
+    image_id = db.Column(db.Integer)
+
+    def __repr__(self):
+        return f'<Listing_view {self.stock_id}>'
+
+
+# Stock count, and the counts and sums average prices and distances are
+# worked out from, per manufacturer, bodystyle and year (see analytics.py).
+# Kept up to date by the listing write paths in the same transaction
+class Inventory_rollup(db.Model):
+    __tablename__ = 'inventory_rollup'
+    dimension = db.Column(db.String(20), primary_key=True)
+    group_key = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    listing_count = db.Column(db.Integer, nullable=False)
+    price_count = db.Column(db.Integer, nullable=False)
+    price_sum = db.Column(db.Integer, nullable=False)
+    distance_count = db.Column(db.Integer, nullable=False)
+    distance_sum = db.Column(db.Integer, nullable=False)
+
+    def __repr__(self):
+        return f'<Inventory_rollup {self.dimension} {self.group_key}>'
+
+
+# Listings of each group per price bucket, to find the bucket its median
+# price is in
+class Price_bucket_rollup(db.Model):
+    __tablename__ = 'price_bucket_rollup'
+    dimension = db.Column(db.String(20), primary_key=True)
+    group_key = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    price_bucket = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    listing_count = db.Column(db.Integer, nullable=False)
+
+    def __repr__(self):
+        return f'<Price_bucket_rollup {self.dimension} {self.group_key} {self.price_bucket}>'
+
+
+# Listings of each group per exact price, in bucket order
+class Price_rollup(db.Model):
+    __tablename__ = 'price_rollup'
+    dimension = db.Column(db.String(20), primary_key=True)
+    group_key = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    price_bucket = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    car_price = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    listing_count = db.Column(db.Integer, nullable=False)
+
+    def __repr__(self):
+        return f'<Price_rollup {self.dimension} {self.group_key} {self.car_price}>'
+
+
+# Listings per value of each inventory page facet, e.g. ('seats', 7). The
+# unfiltered facet counts are read from here
+class Facet_rollup(db.Model):
+    __tablename__ = 'facet_rollup'
+    dimension = db.Column(db.String(20), primary_key=True)
+    group_key = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    listing_count = db.Column(db.Integer, nullable=False)
+
+    def __repr__(self):
+        return f'<Facet_rollup {self.dimension} {self.group_key}>'
@@ -0,0 +1,75 @@
+from models import car_images
+from datetime import date
+from sqlalchemy import text
+from types import SimpleNamespace
+import inventory
+
+# A row to build cursors from, as if the previous page ended on it
+SAMPLE_ROW = SimpleNamespace(stock_id=1000, car_price=25000, year=date(2020, 1, 1),
+                             distance=50000, search_rank=-1.0)
+
+
+# Asks SQLite how it would run a query, one line per step of the plan
+def explain(session, query):
+    statement = query.statement.compile(
+        dialect=session.get_bind().dialect,
+        compile_kwargs={'literal_binds': True},
+    )
+    return [row.detail for row in session.execute(text(f"EXPLAIN QUERY PLAN {statement}"))]
+
+
+# Plan steps that read every row of listing_view or sort a whole result,
+# instead of walking an index. listing_view is stored in stock_id order, so
+# a plain scan is fine when that is the order we want (allow_scan)
+def problems(plan, allow_sort=False, allow_scan=False):
+    found = []
+    for step in plan:
+        if not allow_scan and step.startswith('SCAN listing_view') and 'INDEX' not in step:
+            found.append(step)
+        if not allow_sort and 'USE TEMP B-TREE' in step:
+            found.append(step)
+    return found
+
+
+# The queries behind the inventory page and image route, as (name, query,
+# options for problems())
+def main_queries(session):
+    queries = []
+    for sort in ['price', 'year', 'distance', 'stock_id']:
+        for descending in [False, True]:
+            order = 'desc' if descending else 'asc'
+            cursor = inventory.encode_cursor(sort, descending, SAMPLE_ROW)
+            base = inventory.listing_query(session)
+            options = {'allow_scan': sort == 'stock_id'}
+            queries.append((f"contents sort={sort} order={order}",
+                            inventory.seek(base, sort, descending).limit(26), options))
+            queries.append((f"contents sort={sort} order={order} next page",
+                            inventory.seek(base, sort, descending, cursor).limit(26), options))
+            queries.append((f"contents sort={sort} order={order} previous page",
+                            inventory.seek(base, sort, descending, cursor, backwards=True).limit(26), options))
+
+    # A single make or bodystyle, cheapest first, walks its composite index
+    for name in ['manufacturer', 'bodystyle']:
+        filtered = inventory.apply_filters(inventory.listing_query(session), {name: (1,)})
+        queries.append((f"contents {name} filter sort=price",
+                        inventory.seek(filtered, 'price', False).limit(26), {}))
+
+    # Search results are sorted after matching, but must come through the
+    # full-text index and look cars up by their names
+    searched = inventory.apply_search(inventory.listing_query(session), 'toy cam')
+    queries.append(("contents search sort=relevance",
+                    inventory.seek(searched, 'relevance', False).limit(26), {'allow_sort': True}))
+    queries.append(("contents search sort=price",
+                    inventory.seek(searched, 'price', False).limit(26), {'allow_sort': True}))
+
+    queries.append(("serve_image", session.query(car_images).filter(car_images.image_id == 1), {}))
+    return queries
+
+
+# Explains every main query, returning [(name, plan, problems)]
+def check_query_plans(session):
+    results = []
+    for name, query, options in main_queries(session):
+        plan = explain(session, query)
+        results.append((name, plan, problems(plan, **options)))
+    return results
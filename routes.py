@@ -1,49 +1,273 @@
-from models import Car_manufacturer, Car_bodystyle, Car_model, Car_stock, car_images
+from models import Listing_view, car_images
 from datetime import datetime
-from flask import Flask, g, render_template, request, redirect, send_file, abort
-import sqlite3
-from sqlalchemy.orm import joinedload
-from sqlalchemy.orm import *
-from io import BytesIO
+from flask import current_app, render_template, request, redirect, send_file, abort, url_for, jsonify, Response, stream_with_context
+from io import BytesIO, TextIOWrapper
+from bulk_import import BulkImportError, UnreadableFeed, format_for, import_rows, read_rows
+from cache import cached_page, page_cache
+from metrics import request_metrics
+from database import writes_database
+from assets import ASSET_URL_PATH, asset_file
+from image_store import ImageRejected, get_image_store, size_label, sniff_file_mimetype, sniff_mimetype
+from werkzeug.exceptions import RequestEntityTooLarge
+from variants import VARIANT_SIZES
+import analytics
+import facets
+import feed
+import hashlib
+import inventory
+import listings
+import mimetypes
+import os
+import similar
+import suggest
+import sys
+
+# Browser cache lifetime for images (one year)
+IMAGE_MAX_AGE = 365 * 24 * 60 * 60
+# Browser cache lifetime for built assets, whose names change with their
+# content (one year)
+ASSET_MAX_AGE = 365 * 24 * 60 * 60
+# Cache lifetime for an original sent in place of a resized copy that
+# isn't ready yet
+VARIANT_PENDING_MAX_AGE = 60
+
+
+# Carousel images and text for the home page. The images are mirrored by
+# the asset build, see assets.REMOTE_IMAGES
+CAROUSEL_ITEMS = [
+    {
+        'image': 'images/hero-qashqai.jpg',
+        'caption': 'New Nissan Qashqai', 
+        'subtitle': 'Runout Sale.'
+    },
+    {
+        'image': 'images/hero-navara.jpg',
+        'caption': 'Unbeatable Nissan Navara', 
+        'subtitle': 'Unstoppable Deal.'
+    },
+    {
+        'image': 'images/hero-x-trail.jpg',
+        'caption': 'Innovative E-Power technology', 
+        'subtitle': 'Factory Bonus Offers.'
+    },
+]
+
+
+# Marks a response as public and never changing at its URL
+def immutable(response):
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
 
 # Registering routes to the app
 def register_routes(app, db):
 
     # Creates contents page
     @app.route('/contents')
+    @cached_page
     def contents():
         query = request.args.get('query', '')
-        # Joins to get all cars with their related information into the table
-        cars = db.session.query(Car_stock) \
-            .join(Car_manufacturer) \
-            .join(Car_bodystyle) \
-            .join(Car_model) \
-            .join(car_images) \
-            .options(
-                joinedload(Car_stock.manufacturer),
-                joinedload(Car_stock.bodystyle),
-                joinedload(Car_stock.model),
-                joinedload(Car_stock.image)
+        sort, descending, per_page = inventory.read_sort_args(request.args)
+
+        filters = inventory.read_filters(request.args)
+
+        # Only the columns shown in the table, filtered on the search text
+        # and the structured filters
+        cars = inventory.listing_query(db.session)
+        cars = inventory.apply_search(cars, query)
+        cars = inventory.apply_filters(cars, filters)
+
+        # Seek to the requested page rather than loading the whole inventory
+        try:
+            page = inventory.paginate(
+                cars, sort, descending, per_page,
+                after=request.args.get('after') or None,
+                before=request.args.get('before') or None,
+                search_text=query,
             )
+        except ValueError:
+            abort(400)
 
-        # Filter on manufacturer or model name
+        # Next/prev links keep the search, filters and sort of the current page
+        page_args = {'sort': sort, 'order': 'desc' if descending else 'asc', 'per_page': per_page}
         if query:
-            cars = cars.filter(
-                (Car_manufacturer.manufacturer_name.like(f'%{query}%')) |
-                (Car_model.model_name.like(f'%{query}%'))
-            )
-        
-        cars = cars.all()
-        return render_template('contents.html', cars=cars)
+            page_args['query'] = query
+        page_args.update(inventory.filter_args(filters))
+        next_url = url_for('contents', after=page.next_cursor, **page_args) if page.next_cursor else None
+        prev_url = url_for('contents', before=page.prev_cursor, **page_args) if page.prev_cursor else None
+
+        # Counts for each filter value, e.g. "SUV (1,204)"
+        facet_counts = facets.facet_counts(db.session, query, filters)
+
+        return render_template(
+            'contents.html', cars=page.rows, query=query, sort=sort,
+            descending=descending, per_page=per_page,
+            next_url=next_url, prev_url=prev_url,
+            filters=filters, facets=facet_counts,
+        )
+
+    # Machine-readable inventory for feed consumers. Takes the same search,
+    # filter, sort and cursor args as /contents, plus ?format=ndjson (the
+    # default) or json and an optional ?limit. Rows are streamed as they are
+    # read, so the whole inventory can be exported in one request
+    @app.route('/api/cars')
+    def api_cars():
+        fmt = request.args.get('format', 'ndjson')
+        if fmt not in feed.FEED_FORMATS:
+            abort(400)
+        limit = request.args.get('limit')
+        if limit is not None:
+            if not limit.isdigit() or int(limit) < 1:
+                abort(400)
+            limit = int(limit)
+
+        query = request.args.get('query', '')
+        sort, descending, _ = inventory.read_sort_args(request.args)
+        filters = inventory.read_filters(request.args)
 
-    # Gets image from the database 
+        cars = inventory.listing_query(db.session)
+        cars = inventory.apply_search(cars, query)
+        cars = inventory.apply_filters(cars, filters)
+        try:
+            cars = inventory.seek(cars, sort, descending, request.args.get('after') or None)
+        except ValueError:
+            abort(400)
+
+        stream = feed.stream_json if fmt == 'json' else feed.stream_ndjson
+        return Response(
+            stream_with_context(stream(db.session, cars, sort, descending, limit)),
+            mimetype=feed.FEED_FORMATS[fmt],
+        )
+
+    # Stock counts, average and median prices and average distances per
+    # manufacturer, bodystyle and year. Read from the rollup tables only, so
+    # the page costs the same however big the inventory gets
+    @app.route('/analytics')
+    @cached_page
+    def analytics_page():
+        return render_template('analytics.html', summary=analytics.inventory_summary(db.session))
+
+    # The same figures as JSON
+    @app.route('/api/analytics')
+    def api_analytics():
+        return jsonify(analytics.inventory_summary(db.session))
+
+    # Search box suggestions: makes, models and bodystyles with a word
+    # starting with ?q=, most stocked first. Answered from memory, see
+    # suggest.py
+    @app.route('/api/suggest')
+    def api_suggest():
+        typed = request.args.get('q', '')
+        limit = request.args.get('limit', str(suggest.DEFAULT_SUGGESTIONS))
+        if not limit.isdigit() or not 1 <= int(limit) <= suggest.MAX_SUGGESTIONS:
+            abort(400)
+        found = suggest.suggestions(db.session, typed, int(limit))
+        return jsonify(query=typed, suggestions=[
+            {'text': label, 'kind': kind, 'count': count} for label, kind, count in found
+        ])
+
+    # The cars most like one in stock, on specs, price, age and distance,
+    # nearest first. ?limit= sets how many (10 by default, at most 100)
+    @app.route('/cars/<int:stock_id>/similar')
+    def similar_cars(stock_id):
+        limit = request.args.get('limit', str(similar.DEFAULT_SIMILAR))
+        if not limit.isdigit() or not 1 <= int(limit) <= similar.MAX_SIMILAR:
+            abort(400)
+        nearest = similar.similar_cars(db.session, stock_id, int(limit))
+        if nearest is None:
+            abort(404)
+        rows = inventory.listing_query(db.session) \
+            .filter(Listing_view.stock_id.in_([other_id for other_id, _ in nearest])).all()
+        records = {row.stock_id: feed.feed_record(row) for row in rows}
+        return jsonify(stock_id=stock_id, similar=[
+            # score is the distance between the two cars' scaled specs
+            dict(records[other_id], score=round(score, 4))
+            for other_id, score in nearest if other_id in records
+        ])
+
+    # Gets image from the image store (or the database for unmigrated rows).
+    # An image never changes once stored, so browsers may cache it for a year
+    # without asking again, and revalidate with the content hash as ETag.
+    # ?size=thumb or ?size=medium asks for a resized copy
     @app.route('/images/<int:image_id>')
     def serve_image(image_id):
+        size = request.args.get('size')
+        if size is not None and size not in VARIANT_SIZES:
+            abort(404)
+
         img = db.session.get(car_images, image_id)
-        if not img or not img.image:
+        if not img:
             abort(404)
-        return send_file(BytesIO(img.image), mimetype='image/jpeg')
-    
+
+        # Served straight from disk so the server can use sendfile
+        if img.image_hash:
+            image_store = get_image_store()
+            if size:
+                variant = image_store.variant_path(img.image_hash, size)
+                if os.path.exists(variant):
+                    response = send_file(
+                        variant, mimetype='image/jpeg', etag=f"{img.image_hash}-{size}",
+                        conditional=True, max_age=IMAGE_MAX_AGE,
+                    )
+                    return immutable(response)
+
+            path = image_store.path_for(img.image_hash)
+            if os.path.exists(path):
+                mimetype = img.image_mimetype or sniff_file_mimetype(path)
+                # The resized copy is still being built, so send the original
+                # but let the browser ask again soon
+                max_age = VARIANT_PENDING_MAX_AGE if size else IMAGE_MAX_AGE
+                response = send_file(
+                    path, mimetype=mimetype, etag=img.image_hash,
+                    conditional=True, max_age=max_age,
+                )
+                return response if size else immutable(response)
+
+        # Fallback for rows that haven't been moved out of the database yet
+        if not img.image:
+            abort(404)
+        response = send_file(
+            BytesIO(img.image), mimetype=sniff_mimetype(img.image),
+            etag=hashlib.sha256(img.image).hexdigest(),
+            conditional=True, max_age=IMAGE_MAX_AGE,
+        )
+        return immutable(response)
+
+    # Fingerprinted stylesheets, scripts and mirrored images from
+    # "flask build-assets". Sent brotli or gzip compressed when the browser
+    # accepts it, and cached for good: a changed file gets a new name
+    @app.route(ASSET_URL_PATH + '/<path:filename>')
+    def serve_asset(filename):
+        found = asset_file(filename, request.accept_encodings)
+        if found is None:
+            abort(404)
+        path, encoding = found
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        response = send_file(path, mimetype=mimetype, max_age=ASSET_MAX_AGE)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        return immutable(response)
+
+    # Hit and miss counts of the in-process caches
+    @app.route('/cache-stats')
+    def cache_stats():
+        return jsonify({
+            name: {'hits': cache.hits, 'misses': cache.misses, 'entries': len(cache)}
+            for name, cache in [('pages', page_cache), ('facets', facets.facet_cache)]
+        })
+
+    # Request, SQL and cache counters in the Prometheus text format
+    @app.route('/metrics')
+    def metrics():
+        return Response(request_metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+    # Uploads over MAX_CONTENT_LENGTH are refused before they are read
+    @app.errorhandler(413)
+    def upload_too_large(e):
+        return f"Upload too large, the limit is {size_label(request.max_content_length)}", 413
+
     # Legacy home page
     @app.route('/Legacyhome')
     def legacyhome():
@@ -51,26 +275,9 @@ def register_routes(app, db):
 
     # Creates Main home page 
     @app.route('/')
+    @cached_page
     def devhome():
-        # Loads carousel images and text into the home page
-        carousel_items = [
-            {
-                'image': 'https://www-asia.nissan-cdn.net/content/dam/Nissan/AU/Images/homepage/redesign/compressed/award-NIS4334_Qashqai_2022_homepage_d-with-GDA-2-2000x821.jpg.ximg.full.hero.jpg', 
-                'caption': 'New Nissan Qashqai', 
-                'subtitle': 'Runout Sale.'
-            },
-            {
-                'image': 'https://www-asia.nissan-cdn.net/content/dam/Nissan/AU/Images/homepage/new-navara-pro-4x-homepage-banner-3840x1574.jpg.ximg.full.hero.jpg', 
-                'caption': 'Unbeatable Nissan Navara', 
-                'subtitle': 'Unstoppable Deal.'
-            },
-            {
-                'image': 'https://www-asia.nissan-cdn.net/content/dam/Nissan/new-zealand/images/homepage/NIS5140-13_Nissan-X-TRAIL-Production_Digital_HeroDesktop_1620x1152-v.jpg.ximg.full.hero.jpg', 
-                'caption': 'Innovative E-Power technology', 
-                'subtitle': 'Factory Bonus Offers.'
-            },
-        ]
-        return render_template('home.html', carousel_items=carousel_items)   
+        return render_template('home.html', carousel_items=CAROUSEL_ITEMS)   
 
     # Creates the add listing page
     @app.route('/add-listing', methods=['GET', 'POST'])
@@ -78,120 +285,101 @@ def register_routes(app, db):
         # Render the form to add a new car listing
         if request.method == 'POST':
             try:
-                manufacturer_name = request.form['manufacturer']
-                bodystyle_name = request.form['bodystyle']
                 car_name = request.form['car_name']
-                horsepower = int(request.form['horsepower'])
-                torque = int(request.form['torque'])
-                eco_rating = int(request.form['eco_rating'])
-                safety_rating = int(request.form['safety_rating'])
-                seats = int(request.form['seats'])
-                year = datetime.strptime(request.form['year'], "%Y").date()  
-                price = float(request.form['price'])
-                distance = int(request.form['distance'])
+                year = datetime.strptime(request.form['year'], "%Y").date()
+                car = {
+                    'manufacturer': request.form['manufacturer'],
+                    'bodystyle': request.form['bodystyle'],
+                    'model': car_name,
+                    'horsepower': int(request.form['horsepower']),
+                    'torque': int(request.form['torque']),
+                    'eco_rating': int(request.form['eco_rating']),
+                    'safety_rating': int(request.form['safety_rating']),
+                    'seats': int(request.form['seats']),
+                    'year': year,
+                    'price': float(request.form['price']),
+                    'distance': int(request.form['distance']),
+                }
                 
-                # Handle image upload safely
+                # Copy the upload into the image store in chunks, checking
+                # its size and type before anything touches the database
                 image_file = request.files.get('image')
                 if image_file and image_file.filename != '':
-                    image_data = image_file.read()
-                else:
-                    image_data = b''  # Default empty bytes if no image
-
-                # Check if manufacturer already exists
-                manufacturer = Car_manufacturer.query.filter_by(manufacturer_name=manufacturer_name).first()
-                if not manufacturer:
-                    manufacturer = Car_manufacturer(manufacturer_name=manufacturer_name)
-                    db.session.add(manufacturer)
-                    db.session.commit()
-
-                # Check if bodystyle already exists
-                bodystyle = Car_bodystyle.query.filter_by(bodystyle_name=bodystyle_name).first()
-                if not bodystyle:
-                    bodystyle = Car_bodystyle(bodystyle_name=bodystyle_name)
-                    db.session.add(bodystyle)
-                    db.session.commit()
-
-                # Create model, image, and stock
-                model = Car_model(
-                    model_name=car_name,
-                    model_horsepower=horsepower,
-                    model_torque=torque,
-                    eco_rating=eco_rating,
-                    safety_rating=safety_rating,
-                    model_seats=seats
-                )
-                
-                image = car_images(image=image_data, image_car=f"{car_name}_{year.year}")
-                
-                # Add model and image first to get their IDs
-                db.session.add_all([model, image])
-                db.session.commit()
-                
-                stock = Car_stock(
-                    manufacturer=manufacturer,
-                    bodystyle=bodystyle,
-                    model=model,
-                    year=year,
-                    car_price=price,
-                    distance=distance,
-                    image=image
-                )
+                    car['image_hash'], car['image_mimetype'] = get_image_store().put_stream(
+                        image_file.stream,
+                        max_size=current_app.config['MAX_IMAGE_SIZE'],
+                        allowed_types=current_app.config['IMAGE_TYPES'],
+                    )
+                    car['image_car'] = f"{car_name}_{year.year}"
 
-                # Add stock and commit
-                db.session.add(stock)
-                db.session.commit()
+                # Manufacturer, bodystyle, model, image and stock are all
+                # written in a single transaction
+                listings.create_listing(db.session, car)
+                listings.commit_listings(db.session)
 
                 # Redirect to contents page after adding
                 return redirect('/contents')
-                
+
+            except ImageRejected as e:
+                return f"Error adding listing: {e}", e.status_code
+            except RequestEntityTooLarge:
+                raise
             except Exception as e:
                 db.session.rollback()
                 return f"Error adding listing: {str(e)}", 500
 
         return render_template("add-listing.html")
 
+    # Bulk import of a CSV or JSON lines file. The upload is read row by row
+    # and committed in batches; if it fails part way, the response says how
+    # many rows were saved and the file can be sent again with skip=<rows_done>
+    @app.route('/import', methods=['POST'])
+    def bulk_import_upload():
+        # Feeds are streamed, so they may be far bigger than other uploads
+        request.max_content_length = current_app.config['MAX_IMPORT_SIZE'] or sys.maxsize
+        upload = request.files.get('file')
+        if not upload or upload.filename == '':
+            return jsonify(error="No file uploaded"), 400
+        fmt = request.form.get('format') or format_for(upload.filename)
+        try:
+            skip = int(request.form.get('skip', 0))
+        except ValueError:
+            return jsonify(error="skip must be a number"), 400
+
+        stream = TextIOWrapper(upload.stream, encoding='utf-8', errors='surrogateescape', newline='')
+        try:
+            stats = import_rows(db.session, read_rows(stream, fmt), skip=skip)
+        except UnreadableFeed as e:
+            return jsonify(error=str(e), rows_done=e.rows_done), 400
+        except BulkImportError as e:
+            return jsonify(error=str(e), rows_done=e.rows_done), 500
+        except ValueError as e:
+            return jsonify(error=str(e)), 400
+        return jsonify(stats)
+
     # Dev command for testing database
     @app.route('/add-sample')
+    @writes_database
     def add_sample():
         try:
-            # Check if manufacturer already exists
-            manufacturer = Car_manufacturer.query.filter_by(manufacturer_name="Toyota").first()
-            if not manufacturer:
-                manufacturer = Car_manufacturer(manufacturer_name="Toyota")
-                db.session.add(manufacturer)
-                db.session.commit()
-
-            # Check if bodystyle already exists
-            bodystyle = Car_bodystyle.query.filter_by(bodystyle_name="Sedan").first()
-            if not bodystyle:
-                bodystyle = Car_bodystyle(bodystyle_name="Sedan")
-                db.session.add(bodystyle)
-                db.session.commit()
-
-            model = Car_model(
-                model_name="Camry",
-                model_horsepower=200,
-                model_torque=180,
-                eco_rating=8,
-                safety_rating=9,
-                model_seats=5
-            )
-            image = car_images(image=b"sample_image_data", image_car="Camry_2020")
-            
-            db.session.add_all([model, image])
-            db.session.commit()
-            
-            stock = Car_stock(
-                manufacturer=manufacturer,
-                bodystyle=bodystyle,
-                model=model,
-                year=datetime.strptime("2020-01-01", "%Y-%m-%d").date(),
-                car_price=25000,
-                distance=5000,
-                image=image
-            )
-            db.session.add(stock)
-            db.session.commit()
+            image_data = b"sample_image_data"
+            listings.create_listing(db.session, {
+                'manufacturer': "Toyota",
+                'bodystyle': "Sedan",
+                'model': "Camry",
+                'horsepower': 200,
+                'torque': 180,
+                'eco_rating': 8,
+                'safety_rating': 9,
+                'seats': 5,
+                'year': datetime.strptime("2020-01-01", "%Y-%m-%d").date(),
+                'price': 25000,
+                'distance': 5000,
+                'image_hash': get_image_store().put(image_data),
+                'image_mimetype': sniff_mimetype(image_data),
+                'image_car': "Camry_2020",
+            })
+            listings.commit_listings(db.session)
             return "Sample data added! <br><a href='/contents'>View contents</a> <br><a href='/'>Back to home</a>"
             
         except Exception as e:
@@ -200,43 +388,9 @@ def register_routes(app, db):
     
     # Dev command for testing database - adds 10 cars
     @app.route('/add-10-cars')
+    @writes_database
     def add_10_cars():
         try:
-            # Check if manufacturers already exist
-            toyota = Car_manufacturer.query.filter_by(manufacturer_name="Toyota").first()
-            if not toyota:
-                toyota = Car_manufacturer(manufacturer_name="Toyota")
-                db.session.add(toyota)
-
-            honda = Car_manufacturer.query.filter_by(manufacturer_name="Honda").first()
-            if not honda:
-                honda = Car_manufacturer(manufacturer_name="Honda")
-                db.session.add(honda)
-
-            ford = Car_manufacturer.query.filter_by(manufacturer_name="Ford").first()
-            if not ford:
-                ford = Car_manufacturer(manufacturer_name="Ford")
-                db.session.add(ford)
-
-            # Check if bodystyles already exist
-            sedan = Car_bodystyle.query.filter_by(bodystyle_name="Sedan").first()
-            if not sedan:
-                sedan = Car_bodystyle(bodystyle_name="Sedan")
-                db.session.add(sedan)
-
-            suv = Car_bodystyle.query.filter_by(bodystyle_name="SUV").first()
-            if not suv:
-                suv = Car_bodystyle(bodystyle_name="SUV")
-                db.session.add(suv)
-
-            hatchback = Car_bodystyle.query.filter_by(bodystyle_name="Hatchback").first()
-            if not hatchback:
-                hatchback = Car_bodystyle(bodystyle_name="Hatchback")
-                db.session.add(hatchback)
-
-            # Commit manufacturers and bodystyles first
-            db.session.commit()
-            
             # Create 10 cars 
             cars_data = [
                 # Toyota Cars
@@ -247,8 +401,8 @@ def register_routes(app, db):
                     "eco_rating": 9,
                     "safety_rating": 8,
                     "seats": 5,
-                    "manufacturer": toyota,
-                    "bodystyle": sedan,
+                    "manufacturer": "Toyota",
+                    "bodystyle": "Sedan",
                     "year": datetime.strptime("2021-03-15", "%Y-%m-%d").date(),
                     "price": 22000,
                     "distance": 15000,
@@ -261,8 +415,8 @@ def register_routes(app, db):
                     "eco_rating": 7,
                     "safety_rating": 9,
                     "seats": 5,
-                    "manufacturer": toyota,
-                    "bodystyle": suv,
+                    "manufacturer": "Toyota",
+                    "bodystyle": "SUV",
                     "year": datetime.strptime("2021-06-10", "%Y-%m-%d").date(),
                     "price": 28000,
                     "distance": 12000,
@@ -275,8 +429,8 @@ def register_routes(app, db):
                     "eco_rating": 10,
                     "safety_rating": 8,
                     "seats": 5,
-                    "manufacturer": toyota,
-                    "bodystyle": hatchback,
+                    "manufacturer": "Toyota",
+                    "bodystyle": "Hatchback",
                     "year": datetime.strptime("2022-01-20", "%Y-%m-%d").date(),
                     "price": 26000,
                     "distance": 8000,
@@ -290,8 +444,8 @@ def register_routes(app, db):
                     "eco_rating": 8,
                     "safety_rating": 9,
                     "seats": 5,
-                    "manufacturer": honda,
-                    "bodystyle": sedan,
+                    "manufacturer": "Honda",
+                    "bodystyle": "Sedan",
                     "year": datetime.strptime("2022-04-25", "%Y-%m-%d").date(),
                     "price": 23000,
                     "distance": 10000,
@@ -304,8 +458,8 @@ def register_routes(app, db):
                     "eco_rating": 7,
                     "safety_rating": 9,
                     "seats": 5,
-                    "manufacturer": honda,
-                    "bodystyle": suv,
+                    "manufacturer": "Honda",
+                    "bodystyle": "SUV",
                     "year": datetime.strptime("2021-08-12", "%Y-%m-%d").date(),
                     "price": 27000,
                     "distance": 18000,
@@ -318,8 +472,8 @@ def register_routes(app, db):
                     "eco_rating": 8,
                     "safety_rating": 9,
                     "seats": 5,
-                    "manufacturer": honda,
-                    "bodystyle": sedan,
+                    "manufacturer": "Honda",
+                    "bodystyle": "Sedan",
                     "year": datetime.strptime("2020-11-30", "%Y-%m-%d").date(),
                     "price": 24500,
                     "distance": 22000,
@@ -332,8 +486,8 @@ def register_routes(app, db):
                     "eco_rating": 9,
                     "safety_rating": 7,
                     "seats": 5,
-                    "manufacturer": honda,
-                    "bodystyle": hatchback,
+                    "manufacturer": "Honda",
+                    "bodystyle": "Hatchback",
                     "year": datetime.strptime("2021-02-14", "%Y-%m-%d").date(),
                     "price": 18000,
                     "distance": 25000,
@@ -347,8 +501,8 @@ def register_routes(app, db):
                     "eco_rating": 5,
                     "safety_rating": 7,
                     "seats": 4,
-                    "manufacturer": ford,
-                    "bodystyle": sedan,
+                    "manufacturer": "Ford",
+                    "bodystyle": "Sedan",
                     "year": datetime.strptime("2021-05-18", "%Y-%m-%d").date(),
                     "price": 35000,
                     "distance": 8500,
@@ -361,8 +515,8 @@ def register_routes(app, db):
                     "eco_rating": 6,
                     "safety_rating": 8,
                     "seats": 7,
-                    "manufacturer": ford,
-                    "bodystyle": suv,
+                    "manufacturer": "Ford",
+                    "bodystyle": "SUV",
                     "year": datetime.strptime("2020-09-22", "%Y-%m-%d").date(),
                     "price": 32000,
                     "distance": 30000,
@@ -375,8 +529,8 @@ def register_routes(app, db):
                     "eco_rating": 8,
                     "safety_rating": 8,
                     "seats": 5,
-                    "manufacturer": ford,
-                    "bodystyle": hatchback,
+                    "manufacturer": "Ford",
+                    "bodystyle": "Hatchback",
                     "year": datetime.strptime("2021-12-05", "%Y-%m-%d").date(),
                     "price": 20000,
                     "distance": 15500,
@@ -384,43 +538,30 @@ def register_routes(app, db):
                 }
             ]
 
-            # Add all cars to the database
+            # Store the sample images and add all cars in one transaction
+            image_store = get_image_store()
+            cars = []
             for car_data in cars_data:
-                # Create model
-                model = Car_model(
-                    model_name=car_data["model_name"],
-                    model_horsepower=car_data["horsepower"],
-                    model_torque=car_data["torque"],
-                    eco_rating=car_data["eco_rating"],
-                    safety_rating=car_data["safety_rating"],
-                    model_seats=car_data["seats"]
-                )
-                
-                # Create image with sample data
-                image = car_images(
-                    image=f"{car_data['image_name']}.jpg".encode('utf-8'),
-                    image_car=car_data["image_name"]
-                )
-                
-                # Add model and image to session
-                db.session.add(model)
-                db.session.add(image)
-                db.session.commit()  # Commit to get IDs for foreign keys
-                
-                # Create stock entry
-                stock = Car_stock(
-                    manufacturer=car_data["manufacturer"],
-                    bodystyle=car_data["bodystyle"],
-                    model=model,
-                    year=car_data["year"],
-                    car_price=car_data["price"],
-                    distance=car_data["distance"],
-                    image=image
-                )
-                
-                db.session.add(stock)
+                image_data = f"{car_data['image_name']}.jpg".encode('utf-8')
+                cars.append({
+                    'manufacturer': car_data["manufacturer"],
+                    'bodystyle': car_data["bodystyle"],
+                    'model': car_data["model_name"],
+                    'horsepower': car_data["horsepower"],
+                    'torque': car_data["torque"],
+                    'eco_rating': car_data["eco_rating"],
+                    'safety_rating': car_data["safety_rating"],
+                    'seats': car_data["seats"],
+                    'year': car_data["year"],
+                    'price': car_data["price"],
+                    'distance': car_data["distance"],
+                    'image_hash': image_store.put(image_data),
+                    'image_mimetype': sniff_mimetype(image_data),
+                    'image_car': car_data["image_name"],
+                })
 
-            db.session.commit()
+            listings.create_listings(db.session, cars)
+            listings.commit_listings(db.session)
             return "10 sample cars added successfully! <br><a href='/contents'>View contents</a> <br><a href='/'>Back to home</a>"
             
         except Exception as e:
@@ -0,0 +1,98 @@
+from sqlalchemy import Float, String, bindparam, text
+import re
+
+# Full-text index over the names a car can be searched by, one entry per
+# distinct manufacturer, model and bodystyle. Cars with the same names match
+# the same searches with the same rank, so a search ranks a few names rather
+# than every car in stock and finds their cars through listing_view's name
+# index. The 2/3 character prefix indexes keep "ni*" or "cam*" style searches
+# from walking the whole term list
+CREATE_SEARCH_TABLE = """
+CREATE VIRTUAL TABLE IF NOT EXISTS car_search USING fts5(
+    manufacturer_name,
+    model_name,
+    bodystyle_name,
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '2 3'
+)
+"""
+
+# Names of a set of stock rows, in the column order of car_search
+SELECT_SEARCH_ROWS = """
+SELECT DISTINCT car_manufacturer.manufacturer_name,
+       car_model.model_name, car_bodystyle.bodystyle_name
+FROM car_stock
+JOIN car_manufacturer ON car_manufacturer.manufacturer_id = car_stock.manufacturer_id
+JOIN car_model ON car_model.model_id = car_stock.model_id
+JOIN car_bodystyle ON car_bodystyle.bodystyle_id = car_stock.bodystyle_id
+"""
+
+INSERT_SEARCH_ROWS = "INSERT INTO car_search(manufacturer_name, model_name, bodystyle_name) "
+
+
+# Creates the search table if the database doesn't have one yet
+def create_search_index(connection):
+    connection.execute(text(CREATE_SEARCH_TABLE))
+
+
+# Adds the names of the given stock rows that aren't indexed yet. Runs on the
+# caller's session so the index is written in the same transaction as the
+# cars. Names no car has any more stay until the index is rebuilt: they
+# match no listings, so searches never show them
+def index_stocks(session, stock_ids):
+    stock_ids = list(stock_ids)
+    if not stock_ids:
+        return
+    session.execute(
+        text(INSERT_SEARCH_ROWS + SELECT_SEARCH_ROWS + "WHERE car_stock.stock_id IN :stock_ids "
+             "EXCEPT SELECT manufacturer_name, model_name, bodystyle_name FROM car_search")
+        .bindparams(bindparam('stock_ids', expanding=True)),
+        {'stock_ids': stock_ids},
+    )
+
+
+# Rebuilds the whole index from the stock tables, for databases that were
+# filled before the index existed. Returns the number of indexed names
+def rebuild_search_index(session):
+    create_search_index(session)
+    session.execute(text("DELETE FROM car_search"))
+    session.execute(text(INSERT_SEARCH_ROWS + SELECT_SEARCH_ROWS))
+    # Merges the index segments, so the deleted entries aren't read by every
+    # search until FTS5 gets round to merging them
+    session.execute(text("INSERT INTO car_search(car_search) VALUES('optimize')"))
+    return session.execute(text("SELECT count(*) FROM car_search")).scalar()
+
+
+# Turns free text from the search box into an FTS5 query. Every word must
+# match, and the last letters typed can be the start of a longer word, so
+# "toy cam" finds "Toyota Camry". Returns None if there is nothing to search
+def match_expression(search):
+    words = re.findall(r'\w+', search or '')
+    if not words:
+        return None
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+# The rank cars sorted by relevance start at: the best of any name matching
+# the search, or the worst when sorted worst first. None if nothing matches
+def first_rank(session, match, descending=False):
+    if not match:
+        return None
+    order = 'DESC' if descending else 'ASC'
+    return session.execute(
+        text(f"SELECT rank FROM car_search WHERE car_search MATCH :match ORDER BY rank {order} LIMIT 1"),
+        {'match': match},
+    ).scalar()
+
+
+# Subquery of (manufacturer_name, model_name, bodystyle_name, search_rank)
+# for every set of names matching the search. search_rank is FTS5's bm25
+# rank, where smaller values are better matches
+def search_matches(match):
+    return text(
+        "SELECT manufacturer_name, model_name, bodystyle_name, rank AS search_rank FROM car_search "
+        "WHERE car_search MATCH :match"
+    ) \
+        .bindparams(match=match) \
+        .columns(manufacturer_name=String, model_name=String, bodystyle_name=String, search_rank=Float) \
+        .subquery('search')
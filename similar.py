@@ -0,0 +1,189 @@
+from flask import current_app
+from cache import inventory_version
+import math
+import threading
+import numpy as np
+
+# Specs cars are compared on, in the order of the feature matrix columns.
+# Each is scaled to mean 0 and standard deviation 1, so no single unit (e.g.
+# price in dollars) outweighs the rest
+FEATURES = ['horsepower', 'torque', 'eco_rating', 'safety_rating', 'seats', 'price', 'year', 'distance']
+
+# Feature rows of the cars after a given stock id, in stock id order
+SELECT_FEATURE_ROWS = """
+SELECT car_stock.stock_id,
+       car_model.model_horsepower, car_model.model_torque,
+       car_model.eco_rating, car_model.safety_rating, car_model.model_seats,
+       car_stock.car_price, CAST(strftime('%Y', car_stock.year) AS INTEGER), car_stock.distance
+FROM car_stock
+JOIN car_model ON car_model.model_id = car_stock.model_id
+WHERE car_stock.stock_id > :after
+ORDER BY car_stock.stock_id
+"""
+
+DEFAULT_SIMILAR = 10
+MAX_SIMILAR = 100
+# Rows of the matrix scanned per sample when picking the candidate cut-off
+SAMPLE_STRIDE = 64
+# Slack added to the cut-off for float32 rounding in the fast distances
+ROUNDING_SLACK = 1e-5
+
+
+# Reads straight from the DB-API cursor: building a SQLAlchemy Row for each
+# of a million cars takes several times longer than the query
+def _load_rows(session, after=0):
+    cursor = session.connection().connection.cursor()
+    try:
+        rows = cursor.execute(SELECT_FEATURE_ROWS, {'after': after}).fetchall()
+    finally:
+        cursor.close()
+    if not rows:
+        return np.empty(0, dtype=np.int64), np.empty((0, len(FEATURES)))
+    # None (a spec nobody filled in) comes out as NaN
+    data = np.array(rows, dtype=np.float64)
+    return data[:, 0].astype(np.int64), data[:, 1:]
+
+
+# The feature matrix of every car in stock, kept feature-major (one row per
+# feature, one column per car) so a query reads each feature as one
+# contiguous run. Built once per process, then new listings are appended
+# as other processes bump the inventory version. The scaling is fixed at
+# the last full build; the matrix is rebuilt once it has doubled in size.
+# Readers don't take the lock: refresh publishes the count and arrays as
+# one tuple (and the scaling as another) in a single assignment, so a
+# query sees either the matrix before a refresh or the one after it
+class SimilarIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.version = None
+        self.built_count = 0
+        self.scaling = (np.zeros(len(FEATURES)), np.ones(len(FEATURES)))
+        self.matrix = (
+            0,
+            np.empty(0, dtype=np.int64),
+            np.empty((len(FEATURES), 0), dtype=np.float32),
+            np.empty(0, dtype=np.float32),
+        )
+
+    # Scaled features of raw rows. Missing specs get the mean, i.e. 0
+    def scale(self, raw, scaling=None):
+        mean, std = scaling or self.scaling
+        return np.nan_to_num((raw - mean) / std)
+
+    def _build(self, session):
+        stock_ids, raw = _load_rows(session)
+        scaling = self.scaling
+        if len(raw):
+            mean = np.nanmean(raw, axis=0)
+            std = np.nanstd(raw, axis=0)
+            mean[np.isnan(mean)] = 0
+            std[~(std > 0)] = 1
+            scaling = (mean, std)
+        features = np.ascontiguousarray(self.scale(raw, scaling).T, dtype=np.float32)
+        norms = (features.astype(np.float64) ** 2).sum(axis=0).astype(np.float32)
+        self.built_count = len(stock_ids)
+        self.scaling = scaling
+        self.matrix = (len(stock_ids), stock_ids, features, norms)
+
+    # Appends the cars added since the last look, growing the arrays by
+    # doubling so adding one listing doesn't copy the whole matrix. Only
+    # the columns past the published count are written in place
+    def _append(self, session):
+        count, all_ids, features, norms = self.matrix
+        after = int(all_ids[count - 1]) if count else 0
+        stock_ids, raw = _load_rows(session, after)
+        added = len(stock_ids)
+        if not added:
+            return
+        needed = count + added
+        if needed > len(all_ids):
+            capacity = max(needed, 2 * len(all_ids))
+            all_ids = np.resize(all_ids, capacity)
+            grown = np.empty((len(FEATURES), capacity), dtype=np.float32)
+            grown[:, :count] = features[:, :count]
+            features = grown
+            norms = np.resize(norms, capacity)
+        scaled = self.scale(raw).T
+        all_ids[count:needed] = stock_ids
+        features[:, count:needed] = scaled
+        norms[count:needed] = (scaled ** 2).sum(axis=0)
+        self.matrix = (needed, all_ids, features, norms)
+
+    # Brings the matrix up to date with the database
+    def refresh(self, session):
+        version = inventory_version()
+        with self._lock:
+            if version == self.version:
+                return
+            if self.version is None or self.matrix[0] > 2 * max(self.built_count, 1):
+                self._build(session)
+            else:
+                self._append(session)
+            self.version = version
+
+    # The limit nearest cars to one in stock, as [(stock_id, distance)],
+    # nearest first and ties broken by stock id. None if it isn't in stock.
+    # Squared distances to every car come from one matrix-vector product
+    # (|x|^2 - 2 x.q); the k-th smallest of a strided sample of them is an
+    # upper bound for the k-th smallest overall, so only the few cars under
+    # it are ranked exactly
+    def nearest(self, stock_id, limit=DEFAULT_SIMILAR):
+        count, stock_ids, features, norms = self.matrix
+        position = int(np.searchsorted(stock_ids[:count], stock_id))
+        if position == count or stock_ids[position] != stock_id:
+            return None
+        # One more than asked for, to leave the car itself out
+        wanted = min(limit + 1, count)
+        query = features[:, position].copy()
+
+        distances = np.dot(query, features[:, :count])
+        distances *= -2
+        distances += norms[:count]
+        sample = distances[::SAMPLE_STRIDE]
+        if len(sample) > wanted:
+            cutoff = np.partition(sample, wanted - 1)[wanted - 1]
+            cutoff += ROUNDING_SLACK * (1 + abs(cutoff) + float(norms[position]))
+            candidates = np.flatnonzero(distances <= cutoff)
+        else:
+            candidates = np.arange(count)
+
+        exact = ((features[:, candidates].T.astype(np.float64) - query) ** 2).sum(axis=1)
+        order = np.lexsort((stock_ids[candidates], exact))
+        nearest = []
+        for i in order:
+            if candidates[i] != position:
+                nearest.append((int(stock_ids[candidates[i]]), math.sqrt(exact[i])))
+            if len(nearest) == limit:
+                break
+        return nearest
+
+
+def get_index(session):
+    index = current_app.extensions.get('similar_index')
+    if index is None:
+        index = current_app.extensions.setdefault('similar_index', SimilarIndex())
+    index.refresh(session)
+    return index
+
+
+def similar_cars(session, stock_id, limit=DEFAULT_SIMILAR):
+    return get_index(session).nearest(stock_id, limit)
+
+
+# The same answer worked out one car at a time in plain Python, straight
+# from the database, to check the vectorized one against
+def similar_cars_brute_force(session, stock_id, limit=DEFAULT_SIMILAR):
+    index = get_index(session)
+    stock_ids, raw = _load_rows(session)
+    scaled = index.scale(raw).tolist()
+    stock_ids = stock_ids.tolist()
+    if stock_id not in stock_ids:
+        return None
+    query = scaled[stock_ids.index(stock_id)]
+    found = []
+    for other_id, features in zip(stock_ids, scaled):
+        if other_id != stock_id:
+            distance = math.sqrt(sum((a - b) ** 2 for a, b in zip(features, query)))
+            found.append((distance, other_id))
+    found.sort()
+    return [(other_id, distance) for distance, other_id in found[:limit]]
@@ -0,0 +1,62 @@
+// Search box suggestions. Once typing pauses, asks /api/suggest for the
+// makes, models and bodystyles matching what was typed and offers them in
+// the box's datalist. A request still running when the next one starts is
+// cancelled, so an old answer never replaces a newer one
+(function () {
+    var DEBOUNCE_MS = 150;
+
+    function attach(input) {
+        var list = document.getElementById(input.getAttribute('list'));
+        var url = input.getAttribute('data-suggest-url');
+        var timer = null;
+        var pending = null;
+        var lastTyped = null;
+
+        function show(suggestions) {
+            list.innerHTML = '';
+            suggestions.forEach(function (suggestion) {
+                var option = document.createElement('option');
+                option.value = suggestion.text;
+                option.label = suggestion.kind + ' (' + suggestion.count + ' in stock)';
+                list.appendChild(option);
+            });
+        }
+
+        function fetchSuggestions() {
+            var typed = input.value.trim();
+            if (typed === lastTyped) {
+                return;
+            }
+            lastTyped = typed;
+            if (pending) {
+                pending.abort();
+                pending = null;
+            }
+            if (!typed) {
+                show([]);
+                return;
+            }
+            pending = new AbortController();
+            fetch(url + '?q=' + encodeURIComponent(typed), {signal: pending.signal})
+                .then(function (response) {
+                    return response.ok ? response.json() : {suggestions: []};
+                })
+                .then(function (data) {
+                    pending = null;
+                    show(data.suggestions);
+                })
+                .catch(function (error) {
+                    if (error.name !== 'AbortError') {
+                        show([]);
+                    }
+                });
+        }
+
+        input.addEventListener('input', function () {
+            clearTimeout(timer);
+            timer = setTimeout(fetchSuggestions, DEBOUNCE_MS);
+        });
+    }
+
+    document.querySelectorAll('input[data-suggest-url]').forEach(attach);
+})();
@@ -0,0 +1,124 @@
+from bisect import bisect_left, insort
+from flask import current_app
+from cache import inventory_version
+from sqlalchemy import text
+import re
+import threading
+import unicodedata
+
+DEFAULT_SUGGESTIONS = 8
+MAX_SUGGESTIONS = 20
+
+# Stock count of every name a car can be searched by, for the listings in
+# a range of stock ids. Models are counted with their make, since the same
+# model name can come from two makes
+COUNT_NAMES = """
+SELECT 'manufacturer', manufacturer_name, count(*) FROM listing_view
+WHERE stock_id > :after AND stock_id <= :last
+GROUP BY manufacturer_name
+UNION ALL
+SELECT 'model', manufacturer_name || ' ' || model_name, count(*) FROM listing_view
+WHERE stock_id > :after AND stock_id <= :last
+GROUP BY manufacturer_name, model_name
+UNION ALL
+SELECT 'bodystyle', bodystyle_name, count(*) FROM listing_view
+WHERE stock_id > :after AND stock_id <= :last
+GROUP BY bodystyle_name
+"""
+
+
+# Lower case without accents, the way the full-text index compares words
+def normalize(value):
+    value = unicodedata.normalize('NFKD', value.casefold())
+    return ''.join(char for char in value if not unicodedata.combining(char)).strip()
+
+
+# Every key a name is found under: the whole name, and the rest of it from
+# the start of each later word, so "cor" finds "Toyota Corolla"
+def _keys(label):
+    name = normalize(label)
+    return {name[match.start():] for match in re.finditer(r'\w+', name)} | {name}
+
+
+# Names in stock, kept as a sorted list of (key, kind, label) so the names
+# starting with what was typed are one bisect away, plus the stock count of
+# each (kind, label). Built once per process from listing_view; when the
+# inventory version changes, the counts of the listings added since are
+# merged in. Lookups never touch the database
+class SuggestIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.version = None
+        self.last_stock_id = 0
+        self.keys = []
+        self.counts = {}
+
+    # Stock counts of the listings added since the last look
+    def _count_names(self, session):
+        last = session.execute(text("SELECT max(stock_id) FROM listing_view")).scalar() or 0
+        if last <= self.last_stock_id:
+            return []
+        rows = session.execute(text(COUNT_NAMES), {'after': self.last_stock_id, 'last': last}).all()
+        self.last_stock_id = last
+        return [tuple(row) for row in rows if row[1] is not None]
+
+    # Merges counts into the index. New names go into a copy of the key
+    # list, which then replaces it, so a lookup running at the same time
+    # sees either the old list or the new one
+    def _merge(self, rows):
+        counts = dict(self.counts)
+        new_keys = []
+        for kind, label, count in rows:
+            if (kind, label) not in counts:
+                new_keys.extend((key, kind, label) for key in _keys(label))
+            counts[(kind, label)] = counts.get((kind, label), 0) + count
+        # Counts first: a lookup may pair the new counts with the old keys,
+        # never new keys with counts that lack them
+        self.counts = counts
+        if new_keys:
+            keys = list(self.keys)
+            for key in new_keys:
+                insort(keys, key)
+            self.keys = keys
+
+    # Brings the index up to date with the database
+    def refresh(self, session):
+        version = inventory_version()
+        with self._lock:
+            if version == self.version:
+                return
+            rows = self._count_names(session)
+            if self.version is None:
+                self.counts = {(kind, label): count for kind, label, count in rows}
+                self.keys = sorted((key, kind, label) for kind, label, count in rows for key in _keys(label))
+            else:
+                self._merge(rows)
+            self.version = version
+
+    # Names with a word starting with the typed text, most stocked first, as
+    # [(label, kind, count)]
+    def lookup(self, typed, limit=DEFAULT_SUGGESTIONS):
+        prefix = normalize(typed)
+        if not prefix:
+            return []
+        keys, counts = self.keys, self.counts
+        found = set()
+        for i in range(bisect_left(keys, (prefix,)), len(keys)):
+            key, kind, label = keys[i]
+            if not key.startswith(prefix):
+                break
+            found.add((kind, label))
+        ranked = sorted(found, key=lambda name: (-counts[name], name[1]))
+        return [(label, kind, counts[(kind, label)]) for kind, label in ranked[:limit]]
+
+
+def get_index(session):
+    index = current_app.extensions.get('suggest_index')
+    if index is None:
+        index = current_app.extensions.setdefault('suggest_index', SuggestIndex())
+    index.refresh(session)
+    return index
+
+
+def suggestions(session, typed, limit=DEFAULT_SUGGESTIONS):
+    return get_index(session).lookup(typed, limit)
@@ -0,0 +1,61 @@
+from app import create_app
+from base64 import urlsafe_b64encode
+import inventory
+import json
+import pytest
+
+
+def make_cursor(payload):
+    return urlsafe_b64encode(json.dumps(payload).encode('utf-8')).decode('ascii').rstrip('=')
+
+
+# Cursors whose sort matches but whose values a page query can't bind
+TAMPERED_CURSORS = [
+    ['price', False, 1, [1]],
+    ['price', False, {'a': 1}, 1],
+    ['price', False, [1], 1],
+    ['price', False, True, 1],
+    ['price', False, 1, False],
+    ['price', False, 1, None],
+    ['price', False, '1', 1],
+    ['price', False, 2 ** 64, 1],
+    ['year', False, 2020, 1],
+    ['year', False, 'not a date', 1],
+    ['relevance', False, [1], 1],
+    ['relevance', False, {'a': 1}, 1],
+    ['relevance', False, True, 1],
+]
+
+
+@pytest.fixture
+def client():
+    return create_app('testing').test_client()
+
+
+@pytest.mark.parametrize('payload', TAMPERED_CURSORS)
+def test_decode_cursor_rejects_values_of_the_wrong_type(payload):
+    sort, descending = payload[0], payload[1]
+    with pytest.raises(ValueError, match='Invalid cursor'):
+        inventory.decode_cursor(sort, descending, make_cursor(payload))
+
+
+def test_decode_cursor_reads_its_own_cursors():
+    assert inventory.decode_cursor('price', True, make_cursor(['price', True, 12000, 7])) == (12000, 7)
+    assert inventory.decode_cursor('price', False, make_cursor(['price', False, None, 7])) == (None, 7)
+    assert inventory.decode_cursor('relevance', False, make_cursor(['relevance', False, -1.5, 7])) == (-1.5, 7)
+    value, stock_id = inventory.decode_cursor('year', False, make_cursor(['year', False, '2020-01-01', 7]))
+    assert (value.year, stock_id) == (2020, 7)
+
+
+@pytest.mark.parametrize('payload', [payload for payload in TAMPERED_CURSORS if payload[0] != 'relevance'])
+@pytest.mark.parametrize('url', ['/contents', '/api/cars'])
+def test_tampered_cursor_is_a_bad_request(client, url, payload):
+    response = client.get(url, query_string={'sort': payload[0], 'after': make_cursor(payload)})
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize('payload', [payload for payload in TAMPERED_CURSORS if payload[0] == 'relevance'])
+@pytest.mark.parametrize('direction', ['after', 'before'])
+def test_tampered_search_cursor_is_a_bad_request(client, direction, payload):
+    response = client.get('/contents', query_string={'query': 'toy', direction: make_cursor(payload)})
+    assert response.status_code == 400
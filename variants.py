@@ -0,0 +1,88 @@
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+import logging
+import os
+import tempfile
+import threading
+
+# Pillow is only needed to build the resized copies. Without it the
+# original images are served for every size
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# Longest side, in pixels, of each derived image size
+VARIANT_SIZES = {
+    'thumb': 320,
+    'medium': 800,
+}
+VARIANT_QUALITY = 80
+
+# Worker pool shared by every request in this process, started on first use
+# so a forking server creates it inside each worker rather than the master
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            workers = current_app.config.get('VARIANT_WORKERS', 2)
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='image-variants')
+        return _executor
+
+
+# Writes every missing size of one stored image. Images Pillow can't read
+# are skipped, they just keep being served at full size
+def build_variants(image_store, digest):
+    if Image is None:
+        return 0
+    missing = [size for size in VARIANT_SIZES if not os.path.exists(image_store.variant_path(digest, size))]
+    if not missing:
+        return 0
+
+    try:
+        with Image.open(image_store.path_for(digest)) as original:
+            # Lets JPEGs decode at a fraction of their size when that is
+            # still bigger than the largest variant, which is much faster
+            largest = max(VARIANT_SIZES.values())
+            original.draft('RGB', (largest, largest))
+            # Phone photos are often stored sideways with an EXIF rotation
+            original = ImageOps.exif_transpose(original).convert('RGB')
+    except (OSError, ValueError, Image.DecompressionBombError):
+        logger.info("Not building variants for %s, not a readable image", digest)
+        return 0
+
+    for size in missing:
+        resized = original.copy()
+        resized.thumbnail((VARIANT_SIZES[size], VARIANT_SIZES[size]))
+        path = image_store.variant_path(digest, size)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.variant-')
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                resized.save(tmp, 'JPEG', quality=VARIANT_QUALITY, optimize=True, progressive=True)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    return len(missing)
+
+
+def _build_in_background(image_store, digest):
+    try:
+        build_variants(image_store, digest)
+    except Exception:
+        logger.exception("Building variants for %s failed", digest)
+
+
+# Queues the resized copies of a newly stored image. The request doesn't
+# wait for them; serve_image falls back to the original until they exist
+def schedule_variants(image_store, digest):
+    if Image is None or not digest:
+        return
+    _get_executor().submit(_build_in_background, image_store, digest)